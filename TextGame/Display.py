@@ -8,11 +8,22 @@ Displays Frames to the Command Line
 """
 version_info = 'v0.4'
 
+from array import array
+from heapq import heappop, heappush
+from itertools import groupby
 import logging
+from multiprocessing import resource_tracker
 from multiprocessing.connection import Listener
+from multiprocessing.shared_memory import SharedMemory
 import os
+import re
+from struct import Struct
+from Terminal import Terminal, cursor_to
+import sys
+from threading import Condition
 import time
-from typing import List, Tuple
+from typing import Dict, List, Tuple
+from weakref import WeakValueDictionary
 from Instruction import *
 
 
@@ -20,6 +31,38 @@ logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# 'u' is deprecated from 3.13 on, 'w' is the same UCS4 code point array
+GLYPH_TYPE = 'w' if sys.version_info >= (3, 13) else 'u'
+
+# Cell attributes are packed into a uint16 per cell: bits 0-3 foreground, bits 4-7 background
+# and bit 8 bold. Colours are stored plus one so 0 keeps the terminal's default
+BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE = range(8)
+BOLD = 0x100
+
+def attr(fg: int = None, bg: int = None, bold: bool = False) -> int:
+    """ Packs a foreground colour, background colour and bold into one attribute """
+    value = BOLD if bold else 0
+    if fg is not None:
+        value |= fg + 1
+    if bg is not None:
+        value |= (bg + 1) << 4
+    return value
+
+def sgr(value: int) -> str:
+    """ ANSI escape switching the terminal to attribute value """
+    codes = ['0']
+    if value & BOLD:
+        codes.append('1')
+    if value & 0xF:
+        codes.append(str(29 + (value & 0xF)))
+    if value & 0xF0:
+        codes.append(str(39 + ((value >> 4) & 0xF)))
+    return f'\x1b[{";".join(codes)}m'
+
+def attr_array(count: int, value: int = 0) -> array:
+    """ Returns a new attribute plane of count cells set to value """
+    return array('H', [value]) * count
+
 class DisplayError(Exception):
     def __init__(self):
         raise NotImplementedError("Base class. Should not be called!")
@@ -47,42 +90,238 @@ class FrameBeingDrawn(DisplayError):
         return f'Frame is in use. Please call Draw.{self.frame}.stop() before proceeding'
 
 class Cell:
-    """ Smallest unit of the display. Holds one character """
-    def __init__(self, value: str = ' '):
-        self.value = value
+    """ Smallest unit of the display. A view onto one character of a Frame """
+    __slots__ = ('frame', 'index')
+
+    def __init__(self, frame: 'Frame', index: int):
+        self.frame = frame
+        self.index = index
 
     def __str__(self) -> str:
         return self.value
 
+    @property
+    def value(self) -> str:
+        return self.frame.glyphs[self.index]
+
     def set_value(self, value: str):
-        self.value = value
+        assert len(value) == 1, 'Cell holds one character'
+        self.frame.writable()[self.index] = value
+        row, col = divmod(self.index, self.frame.w)
+        self.frame.touch(row, row + 1, col, col + 1)
+
+    @property
+    def attr(self) -> int:
+        attrs = self.frame.attrs
+        return 0 if attrs is None else attrs[self.index]
+
+    def set_attr(self, value: int):
+        self.frame.writable_attrs()[self.index] = value
+        row, col = divmod(self.index, self.frame.w)
+        self.frame.touch(row, row + 1, col, col + 1)
+
+class Row:
+    """ A view onto one row of Cells in a Frame """
+    __slots__ = ('frame', 'start')
+
+    def __init__(self, frame: 'Frame', row: int):
+        if row < 0:
+            row += frame.h
+        if not 0 <= row < frame.h:
+            raise IndexError('Row index out of range')
+        self.frame = frame
+        self.start = row * frame.w
+
+    def __len__(self) -> int:
+        return self.frame.w
+
+    def __getitem__(self, col: int) -> Cell:
+        if col < 0:
+            col += self.frame.w
+        if not 0 <= col < self.frame.w:
+            raise IndexError('Cell index out of range')
+        return Cell(self.frame, self.start + col)
+
+    def __setitem__(self, col: int, cell: Cell):
+        self[col].set_value(str(cell))
+
+    def __iter__(self):
+        for col in range(self.frame.w):
+            yield Cell(self.frame, self.start + col)
+
+    def __str__(self) -> str:
+        return self.frame.row_string(self.start // self.frame.w)
+
+class Cells:
+    """ List[List[Cell]] style access to the glyphs of a Frame """
+    __slots__ = ('frame', )
+
+    def __init__(self, frame: 'Frame'):
+        self.frame = frame
+
+    def __len__(self) -> int:
+        return self.frame.h
+
+    def __getitem__(self, row: int) -> Row:
+        return Row(self.frame, row)
+
+    def __iter__(self):
+        for row in range(self.frame.h):
+            yield Row(self.frame, row)
+
+def glyph_array(chars: str = '') -> array:
+    """ Returns a new glyph buffer holding chars """
+    return array(GLYPH_TYPE, chars)
 
 class Frame(object):
-    """ Frames hold cells and are displayed with the display """
-    def __init__(self, size: Tuple[int, int], draw: bool = False):
+    """ Frames hold cells and are displayed with the display.\n
+        Glyphs are kept row major in one contiguous array, Frame.cells gives Cell views onto it.\n
+        Row strings are cached, anything writing glyphs must get them from Frame.writable
+        and call Frame.touch for the rows it changed.\n
+        Colour and bold live in the attrs plane next to the glyphs. It stays None
+        (every cell default) until something gets it from Frame.writable_attrs
+    """
+    def __init__(self, size: Tuple[int, int], draw: bool = False, fill_char: str = ' ', glyphs: array = None, attrs: array = None):
         self.h, self.w = size
-        self.cells: List[List[Cell]] = []
+        if glyphs is None:
+            glyphs = glyph_array(fill_char) * (self.h * self.w)
+        self.glyphs: array = glyphs
+        self.attrs: array = attrs
         self.string: str = ''
-        for rows in range(self.h):
-            row = []
-            for col in range(self.w):
-                row.append(Cell())
-            self.cells.append(row)
         self.draw = draw
+        self._rows: List[str] = [None] * self.h
+        self._attr_rows: List[array] = [None] * self.h
+        # Goes up every time a row is touched, lets views notice changes without comparing rows
+        self.row_versions: List[int] = [0] * self.h
+        self._text: str = None
+
+    def touch(self, start: int, stop: int = None, col_start: int = 0, col_stop: int = None):
+        """ Drops the cached strings of rows start to stop (just start if stop is None).\n
+            col_start and col_stop narrow down what changed for subclasses tracking dirty regions
+        """
+        if stop is None:
+            stop = start + 1
+        for row in range(max(start, 0), min(stop, self.h)):
+            self._rows[row] = None
+            self._attr_rows[row] = None
+            self.row_versions[row] += 1
+        self._text = None
+
+    def read_row(self, row: int, col: int, width: int) -> Tuple[array, array]:
+        """ Returns the glyphs and attributes (None without a plane) of width cells of row from col.\n
+            col and width must be inside the frame
+        """
+        start = row * self.w + col
+        attrs = None if self.attrs is None else self.attrs[start:start + width]
+        return self.glyphs[start:start + width], attrs
+
+    def writable(self) -> array:
+        """ Returns the glyph buffer, ready to be written to """
+        return self.glyphs
+
+    @property
+    def colour(self) -> bool:
+        """ If the frame has an attribute plane """
+        return self.attrs is not None
+
+    def write_row(self, row: int, col: int, glyphs: array, attrs: array = None):
+        """ Writes glyphs (and their attributes) into row from col and touches them """
+        start, stop = row * self.w + col, row * self.w + col + len(glyphs)
+        self.writable()[start:stop] = glyphs
+        if attrs is not None or self.attrs is not None:
+            self.writable_attrs()[start:stop] = attrs if attrs is not None else attr_array(len(glyphs))
+        self.touch(row, row + 1, col, col + len(glyphs))
+
+    def writable_attrs(self) -> array:
+        """ Returns the attribute plane, ready to be written to """
+        if self.attrs is None:
+            self.attrs = attr_array(self.h * self.w)
+        return self.attrs
+
+    def row_attrs(self, row: int) -> array:
+        """ Returns the attributes of row, None if the frame has no attribute plane """
+        if self.attrs is None:
+            return None
+        row_attrs = self._attr_rows[row]
+        if row_attrs is None:
+            row_attrs = self.attrs[row * self.w:(row + 1) * self.w]
+            self._attr_rows[row] = row_attrs
+        return row_attrs
+
+    def row_string(self, row: int) -> str:
+        """ Returns row as a string, only rebuilt if the row was touched """
+        row_str = self._rows[row]
+        if row_str is None:
+            start = row * self.w
+            row_str = self.glyphs[start:start + self.w].tounicode()
+            self._rows[row] = row_str
+        return row_str
+
+    @property
+    def cells(self) -> Cells:
+        return Cells(self)
+
+    def copy(self) -> 'Frame':
+        """ Returns a plain Frame with the same glyphs, cached rows are kept """
+        attrs = None if self.attrs is None else array('H', self.attrs)
+        frame = Frame((self.h, self.w), glyphs = array(self.glyphs.typecode, self.glyphs), attrs = attrs)
+        frame._rows = list(self._rows)
+        frame._attr_rows = list(self._attr_rows)
+        frame._text = self._text
+        return frame
 
     def __add__(self, other):
         assert self.draw == False, f'Frame is being drawn'
         assert isinstance(other, Sprite), 'Addition must be Frame + Sprite'
-        for row in range(other.y, other.y + other.h):
-            for col in range(other.x, other.x + other.w):
-                self.cells[row][col] = other.cells[row % other.y][col % other.x]
+        self.blit(other)
+        return self
+
+    def blit(self, sprite: 'Sprite', pos: Tuple[int, int] = None):
+        """ Copies sprite onto the frame at pos (the sprite's own x, y by default).\n
+            The sprite is clipped to the frame, cells matching sprite.transparent are left alone.
+            Attributes come from the sprite's attrs plane, or sprite.attr if it has none
+        """
+        x, y = (sprite.x, sprite.y) if pos is None else pos
+        row_start, row_stop = max(y, 0), min(y + sprite.h, self.h)
+        col_start, col_stop = max(x, 0), min(x + sprite.w, self.w)
+        if row_start >= row_stop or col_start >= col_stop:
+            return
+        # (dst_start, src_start, width) of every slice to copy
+        spans = []
+        if sprite.transparent is None:
+            # Whole rows of the sprite are opaque, one slice per row
+            width = col_stop - col_start
+            src_col = col_start - x
+            for row in range(row_start, row_stop):
+                spans.append((row * self.w + col_start, (row - y) * sprite.w + src_col, width))
+        else:
+            runs = sprite.opaque_runs()
+            for row in range(row_start, row_stop):
+                src_row = (row - y) * sprite.w
+                dst_row = row * self.w + x
+                for start, stop in runs[row - y]:
+                    start, stop = max(start, col_start - x), min(stop, col_stop - x)
+                    if start < stop:
+                        spans.append((dst_row + start, src_row + start, stop - start))
+        dst, src = self.writable(), sprite.glyphs
+        for dst_start, src_start, width in spans:
+            dst[dst_start:dst_start + width] = src[src_start:src_start + width]
+        # Frames without colour skip the attribute plane entirely
+        if sprite.attrs is not None:
+            dst, src = self.writable_attrs(), sprite.attrs
+            for dst_start, src_start, width in spans:
+                dst[dst_start:dst_start + width] = src[src_start:src_start + width]
+        elif sprite.attr or self.attrs is not None:
+            dst = self.writable_attrs()
+            for dst_start, src_start, width in spans:
+                dst[dst_start:dst_start + width] = attr_array(width, sprite.attr)
+        self.touch(row_start, row_stop, col_start, col_stop)
 
     def __str__(self) -> str:
         assert self.draw == False, f'Frame is being drawn'
-        for row in range(self.h):
-            for cell in range(self.w):
-                self.string += str(self.cells[row][cell])
-        return self.string
+        if self._text is None:
+            self._text = ''.join([self.row_string(row) for row in range(self.h)])
+        return self._text
 
 class Draw:
     """ Methods for drawing frames easier """
@@ -90,35 +329,289 @@ class Draw:
         self.self = parent
         self.self.draw = True
 
-    def put_sprite(self, sprite: 'Sprite', position: Tuple[int, int]):
+    def put_sprite(self, sprite: 'Sprite', position: Tuple[int, int] = None):
         assert self.self.draw == True, f'Frame is not drawable'
-        self.self + sprite
+        self.self.blit(sprite, position)
 
-    def fill(self, fill_char: str):
+    def fill(self, fill_char: str, attr: int = None):
         assert self.self.draw == True, f'Frame is not drawable'
-        for row in range(self.self.h):
-            for col in range(self.self.w):
-                self.self.cells[row][col].set_value(fill_char)
+        assert len(fill_char) == 1, 'Cell holds one character'
+        self.self.writable()[:] = glyph_array(fill_char) * len(self.self.glyphs)
+        if attr is not None:
+            self.self.writable_attrs()[:] = attr_array(len(self.self.glyphs), attr)
+        self.self.touch(0, self.self.h)
 
     def stop_drawing(self):
         self.self.draw = False 
 
+class SharedGlyphs:
+    """ Glyph buffer shared between identical sprites. Never written to """
+    def __init__(self, glyphs: array):
+        self.glyphs = glyphs
+        self.runs: Dict[str, List[List[Tuple[int, int]]]] = {}
+
+class SpriteAtlas:
+    """ Interns sprite glyphs so identical sprites reference one buffer.\n
+        Entries are dropped once no sprite uses them anymore
+    """
+    def __init__(self):
+        self.entries: WeakValueDictionary = WeakValueDictionary()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def intern(self, size: Tuple[int, int], chars: str) -> SharedGlyphs:
+        """ Returns the shared glyphs for a sprite of size built from chars """
+        key = (size, chars)
+        shared = self.entries.get(key)
+        if shared is None:
+            assert len(chars) > 0, 'Sprite needs at least one char'
+            # Cells are filled row by row from chars, the last char repeats once chars runs out
+            count = size[0] * size[1]
+            if len(chars) < count:
+                log.debug(('Sprite chars shorter than sprite', 'SpriteAtlas intern'))
+                chars = chars + chars[-1:] * (count - len(chars))
+            shared = SharedGlyphs(glyph_array(chars[:count]))
+            self.entries[key] = shared
+        return shared
+
+atlas = SpriteAtlas()
+
+def opaque_runs(frame: Frame, transparent: str) -> List[List[Tuple[int, int]]]:
+    """ Returns the (start, stop) column runs of cells that are not transparent for each row """
+    runs = []
+    for row in range(frame.h):
+        row_runs = []
+        start = None
+        for col, char in enumerate(frame.row_string(row)):
+            if char == transparent:
+                if start is not None:
+                    row_runs.append((start, col))
+                    start = None
+            elif start is None:
+                start = col
+        if start is not None:
+            row_runs.append((start, frame.w))
+        runs.append(row_runs)
+    return runs
+
 class Sprite(Frame):
-    """ Collection of characters forming a larger unit """
-    def __init__(self, size: Tuple[int, int], chars: str, pos: Tuple[int, int], name = 'Sprite'):
-        super().__init__(size)
+    """ Collection of characters forming a larger unit.\n
+        Cells holding the transparent char are not copied when the sprite is put on a frame.
+        Glyphs come from the atlas and are only copied when the sprite is written to
+    """
+    passable = True
+    def __init__(self, size: Tuple[int, int], chars: str, pos: Tuple[int, int], name = 'Sprite', transparent: str = None, attr: int = 0):
+        self.shared: SharedGlyphs = atlas.intern(tuple(size), chars)
+        super().__init__(size, glyphs = self.shared.glyphs)
+        self.attr = attr
         self.name = name
         self.string = chars
         self.x, self.y = pos
-        chars = list(chars)
-        for row in range(self.h):
-            for col in range(self.w):
-                try:
-                    new_value = chars.pop(0)
-                    self.cells[row][col].set_value(new_value)
-                except IndexError as e:
-                    log.debug((e, 'Sprite init'))
-                    self.cells[row][col].set_value(new_value)
+        self.transparent = transparent
+        self._runs: List[List[Tuple[int, int]]] = None
+
+    def writable(self) -> array:
+        if self.shared is not None:
+            self.glyphs = array(self.glyphs.typecode, self.glyphs)
+            self.shared = None
+        return self.glyphs
+
+    def touch(self, start: int, stop: int = None, col_start: int = 0, col_stop: int = None):
+        super().touch(start, stop, col_start, col_stop)
+        self._runs = None
+
+    def opaque_runs(self) -> List[List[Tuple[int, int]]]:
+        """ Returns the (start, stop) column runs of non transparent cells for each row """
+        if self.shared is not None:
+            runs = self.shared.runs.get(self.transparent)
+            if runs is None:
+                runs = opaque_runs(self, self.transparent)
+                self.shared.runs[self.transparent] = runs
+            return runs
+        if self._runs is None:
+            self._runs = opaque_runs(self, self.transparent)
+        return self._runs
+
+class AnimatedSprite(Sprite):
+    """ A Sprite that steps through frames, each shown for its duration in seconds.\n
+        Every frame is interned in the atlas when the sprite is made, so changing frame
+        only swaps which shared glyphs the sprite points at. frame_attrs gives each frame its own attr
+    """
+    def __init__(self, size: Tuple[int, int], frames: List[str], durations, pos: Tuple[int, int], name = 'AnimatedSprite',
+                 transparent: str = None, attr: int = 0, frame_attrs: List[int] = None, loop: bool = True):
+        assert len(frames) > 0, 'AnimatedSprite needs at least one frame'
+        super().__init__(size, frames[0], pos, name, transparent, attr)
+        self.frames: List[SharedGlyphs] = [atlas.intern(tuple(size), chars) for chars in frames]
+        if isinstance(durations, (int, float)):
+            durations = [durations] * len(frames)
+        assert len(durations) == len(frames), 'One duration per frame'
+        # A timeline would spin forever on a frame that never ends
+        if not all(duration > 0 for duration in durations):
+            raise ValueError(f'Frame durations must be more than 0, got {durations}')
+        self.durations: List[float] = list(durations)
+        self.frame_attrs = frame_attrs
+        self.loop = loop
+        self.index = 0
+        self.set_frame(0)
+
+    def __repr__(self):
+        return f'AnimatedSprite.{self.name}[{self.index}]'
+
+    def set_frame(self, index: int):
+        """ Shows frame index, nothing is copied or parsed """
+        self.index = index
+        self.shared = self.frames[index]
+        self.glyphs = self.shared.glyphs
+        if self.frame_attrs is not None:
+            self.attr = self.frame_attrs[index]
+        self.touch(0, self.h)
+
+class Timeline:
+    """ Advances every AnimatedSprite added to it in one pass per tick.\n
+        Sprites wait in a heap by when their frame next changes, a tick only looks at the ones due
+    """
+    def __init__(self, clock = time.monotonic):
+        self.clock = clock
+        # (due, order, sprite), entries whose due no longer matches the sprite's are stale
+        self.heap: List[Tuple[float, int, AnimatedSprite]] = []
+        self.due: Dict[int, float] = {}
+        self.order = 0
+        self.frames_changed = 0
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    def _push(self, sprite: AnimatedSprite, due: float):
+        self.due[id(sprite)] = due
+        self.order += 1
+        heappush(self.heap, (due, self.order, sprite))
+
+    def add(self, sprite: AnimatedSprite, now: float = None):
+        """ Starts sprite from its current frame """
+        now = self.clock() if now is None else now
+        self._push(sprite, now + sprite.durations[sprite.index])
+
+    def remove(self, sprite: AnimatedSprite):
+        self.due.pop(id(sprite), None)
+
+    def wait_time(self, now: float = None) -> float:
+        """ Returns how long until the next frame changes, None if nothing is playing """
+        while self.heap and self.due.get(id(self.heap[0][2])) != self.heap[0][0]:
+            heappop(self.heap)
+        if not self.heap:
+            return None
+        now = self.clock() if now is None else now
+        return max(0.0, self.heap[0][0] - now)
+
+    def advance(self, now: float = None) -> List[AnimatedSprite]:
+        """ Moves every due sprite on to the frame it should show now, returns the ones that changed """
+        now = self.clock() if now is None else now
+        changed = []
+        while self.heap and self.heap[0][0] <= now:
+            due, _, sprite = heappop(self.heap)
+            if self.due.get(id(sprite)) != due:
+                continue
+            index = sprite.index
+            # A late tick skips the frames it missed
+            while due <= now:
+                if index + 1 == len(sprite.frames):
+                    if not sprite.loop:
+                        break
+                    index = 0
+                else:
+                    index += 1
+                due += sprite.durations[index]
+            if index != sprite.index:
+                sprite.set_frame(index)
+                changed.append(sprite)
+            if due > now:
+                self._push(sprite, due)
+            else:
+                # Played through the last frame of an animation that doesn't loop
+                del self.due[id(sprite)]
+        self.frames_changed += len(changed)
+        return changed
+
+class SpatialIndex:
+    """ Uniform grid of buckets, each holding the sprites whose box overlaps it.\n
+        Answers what is at a cell or inside a rect by only looking at the buckets it covers
+    """
+    def __init__(self, bucket_size: int = 8):
+        self.size = bucket_size
+        self.buckets: Dict[Tuple[int, int], List[Sprite]] = {}
+        self.boxes: Dict[Sprite, Tuple[int, int, int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __contains__(self, sprite: Sprite) -> bool:
+        return sprite in self.boxes
+
+    def _keys(self, box: Tuple[int, int, int, int]):
+        x0, y0, x1, y1 = box
+        size = self.size
+        for by in range(y0 // size, (y1 - 1) // size + 1):
+            for bx in range(x0 // size, (x1 - 1) // size + 1):
+                yield bx, by
+
+    def insert(self, sprite: Sprite):
+        """ Adds sprite at its current x, y """
+        if sprite in self.boxes:
+            self.remove(sprite)
+        box = (sprite.x, sprite.y, sprite.x + sprite.w, sprite.y + sprite.h)
+        self.boxes[sprite] = box
+        for key in self._keys(box):
+            self.buckets.setdefault(key, []).append(sprite)
+
+    def remove(self, sprite: Sprite):
+        box = self.boxes.pop(sprite)
+        for key in self._keys(box):
+            bucket = self.buckets[key]
+            bucket.remove(sprite)
+            if not bucket:
+                del self.buckets[key]
+
+    def move(self, sprite: Sprite, pos: Tuple[int, int]):
+        """ Moves sprite to pos (x, y), only the buckets it left or entered are changed """
+        old = self.boxes[sprite]
+        sprite.x, sprite.y = pos
+        new = (sprite.x, sprite.y, sprite.x + sprite.w, sprite.y + sprite.h)
+        self.boxes[sprite] = new
+        old_keys, new_keys = set(self._keys(old)), set(self._keys(new))
+        for key in old_keys - new_keys:
+            bucket = self.buckets[key]
+            bucket.remove(sprite)
+            if not bucket:
+                del self.buckets[key]
+        for key in new_keys - old_keys:
+            self.buckets.setdefault(key, []).append(sprite)
+
+    def at(self, x: int, y: int) -> List[Sprite]:
+        """ Returns the sprites covering cell x, y """
+        found = []
+        for sprite in self.buckets.get((x // self.size, y // self.size), ()):
+            x0, y0, x1, y1 = self.boxes[sprite]
+            if x0 <= x < x1 and y0 <= y < y1:
+                found.append(sprite)
+        return found
+
+    def query(self, pos: Tuple[int, int], size: Tuple[int, int]) -> List[Sprite]:
+        """ Returns the sprites intersecting the size (h, w) rect at pos (x, y) """
+        x, y = pos
+        h, w = size
+        box = (x, y, x + w, y + h)
+        found = []
+        seen = set()
+        for key in self._keys(box):
+            for sprite in self.buckets.get(key, ()):
+                if id(sprite) in seen:
+                    continue
+                seen.add(id(sprite))
+                x0, y0, x1, y1 = self.boxes[sprite]
+                if x0 < box[2] and box[0] < x1 and y0 < box[3] and box[1] < y1:
+                    found.append(sprite)
+        return found
 
 class Scene(Frame):
 
@@ -126,6 +619,7 @@ class Scene(Frame):
         super().__init__(size)
         self.view = False
         self.name = name
+        self.index = SpatialIndex()
         try:
             self.sprites = sprites
             for sprite in sprites:
@@ -139,75 +633,1063 @@ class Scene(Frame):
 
     def put_sprite(self, sprite: Sprite):
         self + sprite
+        self.index.insert(sprite)
+
+    def blocked(self, sprite: Sprite, pos: Tuple[int, int]) -> bool:
+        """ Returns if sprite can't be at pos (x, y), off the scene or over anything not passable """
+        x, y = pos
+        if x < 0 or y < 0 or x + sprite.w > self.w or y + sprite.h > self.h:
+            return True
+        for other in self.index.query(pos, (sprite.h, sprite.w)):
+            if other is not sprite and not other.passable:
+                return True
+        return False
+
+    def path_blocked(self, sprite: Sprite, pos: Tuple[int, int]) -> bool:
+        """ Returns if sprite can't move from where it is to pos (x, y) in one step.\n
+            Checks the whole rect swept between the two, so a big step can't jump over a wall
+        """
+        if self.blocked(sprite, pos):
+            return True
+        x, y = min(sprite.x, pos[0]), min(sprite.y, pos[1])
+        size = (max(sprite.y, pos[1]) + sprite.h - y, max(sprite.x, pos[0]) + sprite.w - x)
+        for other in self.index.query((x, y), size):
+            if other is not sprite and not other.passable:
+                return True
+        return False
+
+# Side of the square chunks a ChunkedFrame is split into
+CHUNK_SIZE = 64
+
+class ChunkedFrame:
+    """ A sparse Frame for worlds far bigger than anything drawn on them.\n
+        Cells are split into CHUNK_SIZE square chunks, each a plain Frame made on the first
+        write to it. Cells of chunks never written are fill_char, so memory follows what was
+        drawn, not the area. Keys of chunks touched since the last clean_chunks are in dirty_chunks
+    """
+    def __init__(self, size: Tuple[int, int], fill_char: str = ' ', chunk_size: int = CHUNK_SIZE):
+        self.h, self.w = size
+        self.fill_char = fill_char
+        self.chunk_size = chunk_size
+        self.chunks: Dict[Tuple[int, int], Frame] = {}
+        self.dirty_chunks = set()
+        self.colour = False
+        self.draw = False
+        self.row_versions: List[int] = [0] * self.h
+        self.blank = glyph_array(fill_char) * chunk_size
+
+    def chunk(self, key: Tuple[int, int]) -> Frame:
+        """ Returns the chunk at key (chunk row, chunk col), made blank if it doesn't exist yet """
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            row, col = key[0] * self.chunk_size, key[1] * self.chunk_size
+            # Chunks on the far edges are cut down to the world
+            size = (min(self.chunk_size, self.h - row), min(self.chunk_size, self.w - col))
+            chunk = Frame(size, fill_char = self.fill_char)
+            self.chunks[key] = chunk
+            log.debug(f'Made chunk {key}, {len(self.chunks)} chunks')
+        return chunk
+
+    def clean_chunks(self) -> set:
+        """ Returns the keys of the chunks touched since the last call and clears them """
+        dirty, self.dirty_chunks = self.dirty_chunks, set()
+        return dirty
+
+    def touch(self, start: int, stop: int = None, col_start: int = 0, col_stop: int = None):
+        if stop is None:
+            stop = start + 1
+        if col_stop is None:
+            col_stop = self.w
+        start, stop = max(start, 0), min(stop, self.h)
+        col_start, col_stop = max(col_start, 0), min(col_stop, self.w)
+        if start >= stop or col_start >= col_stop:
+            return
+        for row in range(start, stop):
+            self.row_versions[row] += 1
+        size = self.chunk_size
+        for chunk_row in range(start // size, (stop - 1) // size + 1):
+            for chunk_col in range(col_start // size, (col_stop - 1) // size + 1):
+                self.dirty_chunks.add((chunk_row, chunk_col))
+
+    def read_row(self, row: int, col: int, width: int) -> Tuple[array, array]:
+        """ Returns the glyphs and attributes (None without colour) of width cells of row from col """
+        size = self.chunk_size
+        chunk_row, chunk_line = divmod(row, size)
+        glyphs = glyph_array()
+        attrs = attr_array(0) if self.colour else None
+        stop = col + width
+        while col < stop:
+            chunk_col, start = divmod(col, size)
+            count = min(size - start, stop - col)
+            chunk = self.chunks.get((chunk_row, chunk_col))
+            if chunk is None:
+                glyphs.extend(self.blank[:count])
+                if attrs is not None:
+                    attrs.extend(attr_array(count))
+            else:
+                chunk_glyphs, chunk_attrs = chunk.read_row(chunk_line, start, count)
+                glyphs.extend(chunk_glyphs)
+                if attrs is not None:
+                    attrs.extend(chunk_attrs if chunk_attrs is not None else attr_array(count))
+            col += count
+        return glyphs, attrs
+
+    def write_row(self, row: int, col: int, glyphs: array, attrs: array = None):
+        """ Writes glyphs (and their attributes) into row from col and touches them.\n
+            Blank cells going into chunks that don't exist yet don't make them
+        """
+        size = self.chunk_size
+        chunk_row, chunk_line = divmod(row, size)
+        offset = 0
+        while offset < len(glyphs):
+            chunk_col, start = divmod(col + offset, size)
+            count = min(size - start, len(glyphs) - offset)
+            seg = glyphs[offset:offset + count]
+            seg_attrs = None if attrs is None else attrs[offset:offset + count]
+            key = (chunk_row, chunk_col)
+            if key in self.chunks or seg != self.blank[:count] or (seg_attrs is not None and any(seg_attrs)):
+                self.chunk(key).write_row(chunk_line, start, seg, seg_attrs)
+            offset += count
+        if attrs is not None:
+            self.colour = True
+        self.touch(row, row + 1, col, col + len(glyphs))
+
+    def row_string(self, row: int) -> str:
+        return self.read_row(row, 0, self.w)[0].tounicode()
+
+    def load(self, other: 'ChunkedFrame'):
+        """ Copies every chunk of other, a ChunkedFrame of the same size and chunk size """
+        assert (other.h, other.w, other.chunk_size) == (self.h, self.w, self.chunk_size), 'ChunkedFrames must match'
+        size = self.chunk_size
+        for (chunk_row, chunk_col), chunk in other.chunks.items():
+            self.chunks[(chunk_row, chunk_col)] = chunk.copy()
+            self.touch(chunk_row * size, chunk_row * size + chunk.h, chunk_col * size, chunk_col * size + chunk.w)
+        self.colour = self.colour or other.colour
+
+    __add__ = Frame.__add__
+
+    def blit(self, sprite: 'Sprite', pos: Tuple[int, int] = None):
+        """ Frame.blit split over the chunks the sprite lands on, making the missing ones """
+        x, y = (sprite.x, sprite.y) if pos is None else pos
+        row_start, row_stop = max(y, 0), min(y + sprite.h, self.h)
+        col_start, col_stop = max(x, 0), min(x + sprite.w, self.w)
+        if row_start >= row_stop or col_start >= col_stop:
+            return
+        size = self.chunk_size
+        for chunk_row in range(row_start // size, (row_stop - 1) // size + 1):
+            for chunk_col in range(col_start // size, (col_stop - 1) // size + 1):
+                self.chunk((chunk_row, chunk_col)).blit(sprite, (x - chunk_col * size, y - chunk_row * size))
+        if sprite.attrs is not None or sprite.attr:
+            self.colour = True
+        self.touch(row_start, row_stop, col_start, col_stop)
+
+class ChunkedScene(ChunkedFrame):
+    """ A Scene kept in chunks, for stations and maps too big for a Frame """
+    def __init__(self, size: Tuple[int, int], sprites: List[Sprite], name = "Scene", chunk_size: int = CHUNK_SIZE):
+        super().__init__(size, chunk_size = chunk_size)
+        self.view = False
+        self.name = name
+        self.index = SpatialIndex()
+        self.sprites = sprites
+        for sprite in sprites:
+            self.put_sprite(sprite)
+
+    def __repr__(self):
+        return f'ChunkedScene.{self.name}'
+
+    put_sprite = Scene.put_sprite
+    blocked = Scene.blocked
+    path_blocked = Scene.path_blocked
+
+# Glyph of a Layer cell with nothing on it, the layers below show through
+EMPTY = '\0'
+
+def merge_span(spans: Dict[int, List[int]], row: int, col_start: int, col_stop: int):
+    """ Widens the [col_start, col_stop] span kept for row to cover col_start to col_stop """
+    span = spans.get(row)
+    if span is None:
+        spans[row] = [col_start, col_stop]
+    else:
+        span[0] = min(span[0], col_start)
+        span[1] = max(span[1], col_stop)
+
+class DirtySpans:
+    """ Mixin for the layers of a Compositor, dense or chunked.\n
+        Keeps the span of every row changed since the last composite in dirty,
+        the class it's mixed into must set dirty and have touch and write_row
+    """
+    def touch(self, start: int, stop: int = None, col_start: int = 0, col_stop: int = None):
+        super().touch(start, stop, col_start, col_stop)
+        if stop is None:
+            stop = start + 1
+        if col_stop is None:
+            col_stop = self.w
+        col_start, col_stop = max(col_start, 0), min(col_stop, self.w)
+        for row in range(max(start, 0), min(stop, self.h)):
+            merge_span(self.dirty, row, col_start, col_stop)
+
+    def erase(self, pos: Tuple[int, int], size: Tuple[int, int]):
+        """ Empties the size (h, w) area at pos (x, y) """
+        x, y = pos
+        h, w = size
+        col_start, col_stop = max(x, 0), min(x + w, self.w)
+        if col_start >= col_stop:
+            return
+        blank = glyph_array(EMPTY) * (col_stop - col_start)
+        for row in range(max(y, 0), min(y + h, self.h)):
+            self.write_row(row, col_start, blank)
+
+class Layer(DirtySpans, Frame):
+    """ A named, z ordered Frame composited by the Compositor. EMPTY cells are see through """
+    def __init__(self, size: Tuple[int, int], name: str, z: int, fill_char: str = EMPTY):
+        super().__init__(size, fill_char = fill_char)
+        self.name = name
+        self.z = z
+        # row -> [col_start, col_stop] changed since the last composite
+        self.dirty: Dict[int, List[int]] = {}
+        self.touch(0, self.h)
+
+    def __repr__(self):
+        return f'Layer.{self.name}'
+
+class ChunkedLayer(DirtySpans, ChunkedFrame):
+    """ A Layer kept in chunks, the Compositor makes these for ChunkedFrame targets """
+    def __init__(self, size: Tuple[int, int], name: str, z: int, fill_char: str = EMPTY):
+        super().__init__(size, fill_char)
+        self.name = name
+        self.z = z
+        # row -> [col_start, col_stop] changed since the last composite, an empty layer has nothing to show
+        self.dirty: Dict[int, List[int]] = {}
+
+    def __repr__(self):
+        return f'ChunkedLayer.{self.name}'
+
+class Compositor:
+    """ Stacks named layers by z and writes the result into a target Frame.\n
+        Only the dirty spans of each layer are recomposited and layers fully hidden
+        under opaque layers above them are never read
+    """
+    def __init__(self, target: Frame, background: str = ' '):
+        self.target = target
+        self.background = background
+        self.size = (target.h, target.w)
+        self.layers: List[Layer] = []
+        self.names: Dict[str, Layer] = {}
+
+    def add_layer(self, name: str, z: int, fill_char: str = EMPTY) -> Layer:
+        assert name not in self.names, f'Layer {name} already exists'
+        # Sparse targets get sparse layers, a dense layer the size of the world would defeat them
+        layer_type = ChunkedLayer if isinstance(self.target, ChunkedFrame) else Layer
+        layer = layer_type(self.size, name, z, fill_char)
+        self.layers.append(layer)
+        # Top layer first, that's the order composite reads them in
+        self.layers.sort(key = lambda layer: layer.z, reverse = True)
+        self.names[name] = layer
+        return layer
+
+    def layer(self, name: str) -> Layer:
+        return self.names[name]
+
+    def _spans(self) -> Dict[int, List[int]]:
+        """ Merges and resets the dirty spans of every layer """
+        spans: Dict[int, List[int]] = {}
+        for layer in self.layers:
+            for row, (col_start, col_stop) in layer.dirty.items():
+                merge_span(spans, row, col_start, col_stop)
+            layer.dirty = {}
+        return spans
+
+    def composite_span(self, row: int, col_start: int, col_stop: int) -> Tuple[str, array]:
+        """ Returns the glyphs and attributes the stacked layers show in a span of one row.\n
+            Attributes are None when no layer has an attribute plane
+        """
+        width = col_stop - col_start
+        colour = any(layer.colour for layer in self.layers)
+        out: List[str] = None
+        out_attrs: List[int] = None
+        missing = width
+        for layer in self.layers:
+            seg_glyphs, seg_attrs = layer.read_row(row, col_start, width)
+            seg = seg_glyphs.tounicode()
+            if out is None:
+                if EMPTY not in seg:
+                    if colour and seg_attrs is None:
+                        seg_attrs = attr_array(width)
+                    return seg, seg_attrs
+                out = list(seg)
+                out_attrs = [0] * width
+                if seg_attrs is not None:
+                    for col, char in enumerate(seg):
+                        if char != EMPTY:
+                            out_attrs[col] = seg_attrs[col]
+                missing = seg.count(EMPTY)
+                continue
+            for col, char in enumerate(seg):
+                if char != EMPTY and out[col] == EMPTY:
+                    out[col] = char
+                    if seg_attrs is not None:
+                        out_attrs[col] = seg_attrs[col]
+                    missing -= 1
+            if missing == 0:
+                break
+        if out is None:
+            return self.background * width, attr_array(width) if colour else None
+        return ''.join(out).replace(EMPTY, self.background), array('H', out_attrs) if colour else None
+
+    def composite(self) -> int:
+        """ Recomposites the dirty spans into the target, returns how many rows changed """
+        spans = self._spans()
+        if not spans:
+            return 0
+        for row, (col_start, col_stop) in spans.items():
+            text, attrs = self.composite_span(row, col_start, col_stop)
+            self.target.write_row(row, col_start, glyph_array(text), attrs)
+        return len(spans)
+
+class Camera:
+    """ A display sized window onto a world sized scene.\n
+        render copies only the view rows whose world row changed or came into view,
+        rows still visible after a vertical pan are reused from the last render
+    """
+    def __init__(self, world: Frame, size: Tuple[int, int], pos: Tuple[int, int] = (0, 0), fill_char: str = ' '):
+        self.world = world
+        self.h, self.w = size
+        self.view = Frame(size, fill_char = fill_char)
+        self.fill_char = fill_char
+        self.x, self.y = 0, 0
+        # (world row, row version) held by each view row, None when it holds nothing yet
+        self.held: List[Tuple[int, int]] = [None] * self.h
+        self.held_x: int = None
+        self.rows_copied: int = 0
+        self.move_to(pos)
+
+    def __repr__(self):
+        return f'Camera({self.x}, {self.y}, {self.h}x{self.w})'
+
+    def move_to(self, pos: Tuple[int, int]):
+        """ Puts the top left of the view at world pos (x, y), kept inside the world """
+        x, y = pos
+        self.x = max(0, min(x, self.world.w - self.w))
+        self.y = max(0, min(y, self.world.h - self.h))
+
+    def pan(self, dx: int, dy: int):
+        self.move_to((self.x + dx, self.y + dy))
+
+    def follow(self, sprite: 'Sprite'):
+        """ Centres the view on sprite """
+        self.move_to((sprite.x + sprite.w // 2 - self.w // 2, sprite.y + sprite.h // 2 - self.h // 2))
+
+    def render(self) -> Frame:
+        """ Brings the view up to date with the world and returns it """
+        world, view = self.world, self.view
+        if self.x != self.held_x:
+            # Every row moved sideways, nothing can be reused
+            self.held = [None] * self.h
+            self.held_x = self.x
+        held_at = {held[0]: row for row, held in enumerate(self.held) if held is not None}
+        old_glyphs = old_attrs = None
+        width = max(0, min(self.w, world.w - self.x))
+        new_held = [None] * self.h
+        glyphs = view.writable()
+        for row in range(self.h):
+            world_row = self.y + row
+            start = row * self.w
+            if world_row >= world.h:
+                if self.held[row] != (-1, 0):
+                    glyphs[start:start + self.w] = glyph_array(self.fill_char) * self.w
+                    if view.attrs is not None:
+                        view.attrs[start:start + self.w] = attr_array(self.w)
+                    view.touch(row)
+                new_held[row] = (-1, 0)
+                continue
+            version = world.row_versions[world_row]
+            new_held[row] = (world_row, version)
+            old_row = held_at.get(world_row)
+            if old_row == row and self.held[row][1] == version:
+                continue
+            if old_row is not None and self.held[old_row][1] == version:
+                # Still on screen from the last render, just in another row
+                if old_glyphs is None:
+                    old_glyphs = array(glyphs.typecode, glyphs)
+                    old_attrs = None if view.attrs is None else array('H', view.attrs)
+                old_start = old_row * self.w
+                glyphs[start:start + self.w] = old_glyphs[old_start:old_start + self.w]
+                if old_attrs is not None:
+                    view.attrs[start:start + self.w] = old_attrs[old_start:old_start + self.w]
+            else:
+                row_glyphs, row_attrs = world.read_row(world_row, self.x, width)
+                glyphs[start:start + width] = row_glyphs
+                if width < self.w:
+                    glyphs[start + width:start + self.w] = glyph_array(self.fill_char) * (self.w - width)
+                if row_attrs is not None or view.attrs is not None:
+                    attrs = view.writable_attrs()
+                    attrs[start:start + width] = row_attrs if row_attrs is not None else attr_array(width)
+                self.rows_copied += 1
+            view.touch(row)
+        self.held = new_held
+        return view
+
+# FrameBuffer overflow policies
+BLOCK = 'block'             # put waits for a free slot, NoBufferSpace after the timeout
+DROP_OLDEST = 'dropOldest'  # put pushes out the oldest waiting frame
+KEEP_NEWEST = 'keepNewest'  # put replaces every waiting frame, only the newest is kept
 
 class FrameBuffer(object):
-    """ Holds frames for the display """
-    def __init__(self, max_length: int):
+    """ Fixed size ring of frames waiting for the display.\n
+        The frame last returned by get is the front frame and is returned again
+        until a newer one is put, so the ring works as a double/triple buffer.\n
+        Under BLOCK it is a single producer, single consumer ring: only put moves write and
+        only get moves read, so one thread can put while another gets. The dropping
+        policies move read from put too and are for a display putting and getting in one thread
+    """
+    def __init__(self, max_length: int, policy: str = DROP_OLDEST, timeout: float = None, front: Frame = None):
+        assert max_length > 0, 'FrameBuffer needs at least one slot'
+        assert policy in (BLOCK, DROP_OLDEST, KEEP_NEWEST), f'Unknown policy {policy}'
         self.max = max_length
-        self.buffer: List[Frame] = []
+        self.policy = policy
+        self.timeout = timeout
+        self.slots: List[Frame] = [None] * max_length
+        # Frames ever taken and ever put, the waiting ones are slots read to write (mod max)
+        self.read: int = 0
+        self.write: int = 0
+        self.front: Frame = front
+        self.puts: int = 0
+        self.gets: int = 0
+        self.dropped: int = 0
+        # A full ring under BLOCK waits here for get to free a slot
+        self.not_full = Condition()
         log.debug('Buffer created')
 
+    def __repr__(self):
+        return f'FrameBuffer({self.count}/{self.max}, {self.policy})'
+
+    @property
+    def count(self) -> int:
+        return self.write - self.read
+
     def is_full(self) -> bool:
         """ Returns if buffer is full """
-        if len(self.buffer) >= self.max:
-            return True
-        return False
+        return self.count >= self.max
+
+    def len(self) -> int:
+        return self.count
+
+    def occupancy(self) -> float:
+        """ Fraction of the slots holding waiting frames """
+        return self.count / self.max
+
+    def stats(self) -> Dict[str, int]:
+        return {'waiting': self.count, 'size': self.max, 'puts': self.puts,
+                'gets': self.gets, 'dropped': self.dropped}
 
-    def len(self):
-        return len(self.buffer)
+    def _drop_oldest(self):
+        self.slots[self.read % self.max] = None
+        self.read += 1
+        self.dropped += 1
 
-    def put(self, Frame: Frame):
-        self.buffer.append(Frame)
+    def put(self, frame: Frame):
+        if self.policy == KEEP_NEWEST:
+            while self.count:
+                self._drop_oldest()
+        elif self.is_full():
+            if self.policy == DROP_OLDEST:
+                self._drop_oldest()
+            else:
+                with self.not_full:
+                    if not self.not_full.wait_for(lambda: not self.is_full(), self.timeout):
+                        raise NoBufferSpace(repr(self))
+        # The slot is filled before write moves, get never sees it half put
+        self.slots[self.write % self.max] = frame
+        self.write += 1
+        self.puts += 1
 
     def get(self) -> Frame:
-        return self.buffer.pop(0)
+        """ Returns the next waiting frame, or the front frame again if none are waiting """
+        if self.write != self.read:
+            index = self.read % self.max
+            self.front = self.slots[index]
+            self.slots[index] = None
+            self.gets += 1
+            if self.policy == BLOCK:
+                # Moved under the lock so a put waiting on a full ring can't miss it
+                with self.not_full:
+                    self.read += 1
+                    self.not_full.notify()
+            else:
+                self.read += 1
+        return self.front
 
     def clear(self):
-        self.buffer: List[Frame] = []
-    
+        while self.count:
+            self._drop_oldest()
+
+def changed_runs(old: str, new: str, gap: int = 6, old_attrs: array = None, new_attrs: array = None) -> List[Tuple[int, int]]:
+    """ Returns (start, stop) column runs where new (or its attributes) differs from old.\n
+        Runs closer than gap are joined, rewriting a few cells is cheaper than another cursor move
+    """
+    runs: List[Tuple[int, int]] = []
+    start = None
+    last = -gap - 1
+    if old_attrs is not None or new_attrs is not None:
+        # Compare glyph and attribute together, a missing plane is all default
+        old = list(zip(old, old_attrs if old_attrs is not None else attr_array(len(old))))
+        new = list(zip(new, new_attrs if new_attrs is not None else attr_array(len(new))))
+    for col in range(len(new)):
+        if old[col] != new[col]:
+            if start is None:
+                start = col
+            elif col - last > gap:
+                runs.append((start, last + 1))
+                start = col
+            last = col
+    if start is not None:
+        runs.append((start, last + 1))
+    return runs
+
+class FrameDelta:
+    """ The runs of cells that changed between two frames sent to a display.\n
+        A keyframe holds every row and is applied to a blank frame,
+        anything else is applied to the frame with sequence number base.\n
+        Runs are (row, col, text, attrs), attrs is None for cells with default attributes
+    """
+    def __init__(self, seq: int, base: int, size: Tuple[int, int], runs: List[Tuple[int, int, str, array]], keyframe: bool = False):
+        self.seq = seq
+        self.base = base
+        self.size = size
+        self.runs = runs
+        self.keyframe = keyframe
+
+    def __repr__(self):
+        return f'FrameDelta({self.base}->{self.seq}, {len(self.runs)} runs, keyframe = {self.keyframe})'
+
+    def apply(self, frame: Frame = None) -> Frame:
+        """ Returns a new Frame holding frame with the runs written over it """
+        frame = Frame(self.size) if self.keyframe or frame is None else frame.copy()
+        glyphs = frame.writable()
+        for row, col, text, attrs in self.runs:
+            start = row * frame.w + col
+            glyphs[start:start + len(text)] = glyph_array(text)
+            if attrs is not None:
+                frame.writable_attrs()[start:start + len(text)] = attrs
+            elif frame.attrs is not None:
+                frame.attrs[start:start + len(text)] = attr_array(len(text))
+            frame.touch(row, row + 1, col, col + len(text))
+        return frame
+
+class DeltaEncoder:
+    """ Remembers the rows last sent to each destination and encodes frames as deltas against them.\n
+        Connections are ordered and reliable, so a sent delta counts as acknowledged.
+        Every keyframe_every frames (or after reset) a keyframe is sent instead
+    """
+    def __init__(self, keyframe_every: int = 100):
+        self.keyframe_every = keyframe_every
+        self.sent: Dict[str, List[str]] = {}
+        self.sent_attrs: Dict[str, List[array]] = {}
+        self.seq: Dict[str, int] = {}
+
+    def reset(self, destination: str = None):
+        """ The next frame to destination (every destination if None) is a keyframe """
+        if destination is None:
+            self.sent = {}
+            self.sent_attrs = {}
+        else:
+            self.sent.pop(destination, None)
+            self.sent_attrs.pop(destination, None)
+
+    def encode(self, destination: str, frame: Frame) -> FrameDelta:
+        base = self.seq.get(destination, 0)
+        seq = base + 1
+        self.seq[destination] = seq
+        rows = [frame.row_string(row) for row in range(frame.h)]
+        attrs = [frame.row_attrs(row) for row in range(frame.h)]
+        old = self.sent.get(destination)
+        old_attrs = self.sent_attrs.get(destination)
+        self.sent[destination] = rows
+        self.sent_attrs[destination] = attrs
+        if old is None or len(old) != len(rows) or len(old[0]) != frame.w or seq % self.keyframe_every == 0:
+            return FrameDelta(seq, base, (frame.h, frame.w),
+                              [(row, 0, text, attrs[row]) for row, text in enumerate(rows)], True)
+        runs = []
+        for row, text in enumerate(rows):
+            row_attrs = attrs[row]
+            same_attrs = row_attrs is old_attrs[row] or row_attrs == old_attrs[row]
+            if same_attrs and (text is old[row] or text == old[row]):
+                continue
+            if same_attrs:
+                found = changed_runs(old[row], text)
+            else:
+                found = changed_runs(old[row], text, old_attrs = old_attrs[row], new_attrs = row_attrs)
+            for start, stop in found:
+                runs.append((row, start, text[start:stop], None if row_attrs is None else row_attrs[start:stop]))
+        return FrameDelta(seq, base, (frame.h, frame.w), runs)
+
+class SharedFrameBuffer:
+    """ A frame in shared memory, written by the game engine and read in place by the display.\n
+        Layout: header (seq, h, w, colour), a bitmap of the rows changed by the last write,
+        the glyphs as UTF-32 rows, then the uint16 attribute plane (only used if colour is set).
+        seq is odd while a write is in progress and goes up by 2 per write
+    """
+    HEADER = Struct('<QIIB')
+
+    def __init__(self, size: Tuple[int, int] = None, name: str = None):
+        if name is None:
+            self.h, self.w = size
+            self._layout()
+            self.shm = SharedMemory(create = True, size = self.attr_start + self.h * self.w * 2)
+            self.HEADER.pack_into(self.shm.buf, 0, 0, self.h, self.w, 0)
+            self.owner = True
+        else:
+            # Only the owner may unlink, don't let this process' tracker do it on exit
+            if sys.version_info >= (3, 13):
+                self.shm = SharedMemory(name = name, track = False)
+            else:
+                self.shm = SharedMemory(name = name)
+                if os.name == 'posix':
+                    resource_tracker.unregister(self.shm._name, 'shared_memory')
+            seq, self.h, self.w, colour = self.HEADER.unpack_from(self.shm.buf, 0)
+            self._layout()
+            self.owner = False
+        self.name = self.shm.name
+        self.seq: int = 0
+        self.rows: List[str] = None
+        self.attr_rows: List[array] = None
+
+    def _layout(self):
+        self.bitmap_start = self.HEADER.size
+        self.glyph_start = self.bitmap_start + (self.h + 7) // 8
+        self.attr_start = self.glyph_start + self.h * self.w * 4
+
+    def __repr__(self):
+        return f'SharedFrameBuffer({self.name}, {self.h}x{self.w}, seq = {self.seq})'
+
+    def write(self, frame: Frame) -> int:
+        """ Writes the rows of frame that changed since the last write, returns the new seq """
+        assert (frame.h, frame.w) == (self.h, self.w), 'Frame size does not match the shared buffer'
+        buf = self.shm.buf
+        rows = [frame.row_string(row) for row in range(frame.h)]
+        attr_rows = [frame.row_attrs(row) for row in range(frame.h)]
+        colour = frame.attrs is not None
+        self.seq += 1
+        self.HEADER.pack_into(buf, 0, self.seq, self.h, self.w, colour)
+        bitmap = bytearray((self.h + 7) // 8)
+        row_bytes = self.w * 4
+        attr_bytes = self.w * 2
+        for row, text in enumerate(rows):
+            row_attrs = attr_rows[row]
+            if self.rows is not None and (text is self.rows[row] or text == self.rows[row]) \
+                    and (row_attrs is self.attr_rows[row] or row_attrs == self.attr_rows[row]):
+                continue
+            start = self.glyph_start + row * row_bytes
+            buf[start:start + row_bytes] = text.encode('utf-32-le')
+            if colour:
+                start = self.attr_start + row * attr_bytes
+                buf[start:start + attr_bytes] = row_attrs.tobytes()
+            bitmap[row >> 3] |= 1 << (row & 7)
+        buf[self.bitmap_start:self.glyph_start] = bitmap
+        self.rows = rows
+        self.attr_rows = attr_rows
+        self.seq += 1
+        self.HEADER.pack_into(buf, 0, self.seq, self.h, self.w, colour)
+        return self.seq
+
+    def read(self, frame: Frame = None) -> Frame:
+        """ Returns the shared frame, reusing the rows of frame that didn't change.\n
+            Returns None if a write is in progress, the next frame ready notice will retry
+        """
+        buf = self.shm.buf
+        seq, h, w, colour = self.HEADER.unpack_from(buf, 0)
+        if seq & 1:
+            return None
+        # The bitmap only covers the last write, read everything if writes were missed
+        whole = frame is None or seq != self.seq + 2 or (colour and frame.attrs is None)
+        bitmap = bytes(buf[self.bitmap_start:self.glyph_start])
+        frame = Frame((self.h, self.w)) if frame is None else frame.copy()
+        glyphs = frame.writable()
+        if colour:
+            attrs = frame.writable_attrs()
+        else:
+            frame.attrs = None
+        row_bytes = self.w * 4
+        attr_bytes = self.w * 2
+        for row in range(self.h):
+            if not whole and not bitmap[row >> 3] & (1 << (row & 7)):
+                continue
+            start = self.glyph_start + row * row_bytes
+            glyphs[row * self.w:(row + 1) * self.w] = glyph_array(str(buf[start:start + row_bytes], 'utf-32-le'))
+            if colour:
+                start = self.attr_start + row * attr_bytes
+                attrs[row * self.w:(row + 1) * self.w] = array('H', bytes(buf[start:start + attr_bytes]))
+            frame.touch(row)
+        if self.HEADER.unpack_from(buf, 0)[0] != seq:
+            return None
+        self.seq = seq
+        return frame
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+# Terminals supporting synchronized output hold the screen between these, so frames are never torn
+SYNC_START = b'\x1b[?2026h'
+SYNC_END = b'\x1b[?2026l'
+
+class TerminalBackend:
+    """ Output to a real terminal. Everything is done with ANSI escapes, no subprocesses.\n
+        Writes are gathered in one preallocated buffer and each flush hands the
+        whole buffer to the terminal with a single os.write. Clearing, the title and
+        the size go through a Terminal, which skips them when nothing would change
+    """
+    def __init__(self, out = None, capacity: int = 1 << 16, synchronized: bool = True):
+        self.out = out if out is not None else sys.stdout
+        try:
+            self.fd = self.out.fileno()
+        except (AttributeError, OSError, ValueError):
+            # Streams without a file descriptor (StringIO and friends) get the text instead
+            self.fd = None
+        self.synchronized = synchronized
+        # The start of the buffer is kept for SYNC_START so a flush never copies
+        self.buffer = bytearray(capacity)
+        self.start = len(SYNC_START)
+        self.buffer[:self.start] = SYNC_START
+        self.length: int = self.start
+        self.syscalls: int = 0
+        self.terminal = Terminal(self)
+
+    def _append(self, data: bytes):
+        end = self.length + len(data)
+        if end > len(self.buffer):
+            self.buffer.extend(bytes(max(end, 2 * len(self.buffer)) - len(self.buffer)))
+        self.buffer[self.length:end] = data
+        self.length = end
+
+    def write(self, data: str):
+        self._append(data.encode('utf-8'))
+        self.terminal.touch()
+
+    def flush(self):
+        if self.length == self.start:
+            return
+        if self.fd is None:
+            self.out.write(self.buffer[self.start:self.length].decode('utf-8'))
+            self.out.flush()
+        else:
+            # Text written through print() or the logger must reach the terminal first
+            self.out.flush()
+            start = 0
+            if self.synchronized:
+                self._append(SYNC_END)
+            else:
+                start = self.start
+            with memoryview(self.buffer) as view:
+                while start < self.length:
+                    start += os.write(self.fd, view[start:self.length])
+                    self.syscalls += 1
+        self.length = self.start
+
+    def clear(self):
+        self.terminal.clear()
+
+    def set_title(self, title: str):
+        self.terminal.set_title(title)
+
+    def set_size(self, size: Tuple[int, int]):
+        """ Asks the terminal to resize to size (h, w), terminals without xterm window ops ignore it """
+        self.terminal.set_size(size)
+
+class HeadlessBackend(TerminalBackend):
+    """ Output to memory. Records what would have been written and keeps
+        the screen it would have produced, for tests and benchmarks
+    """
+    ESCAPE = re.compile('\x1b\\[([0-9;?]*)([A-Za-z])|\x1b\\]0;([^\x07]*)\x07|(\n)|([^\x1b\n]+)')
+
+    def __init__(self, size: Tuple[int, int] = (24, 80), record: bool = True):
+        self.h, self.w = size
+        self.record = record
+        self.written: List[str] = []
+        self.bytes_written: int = 0
+        self.flushes: int = 0
+        self.title: str = ''
+        self.attr: int = 0
+        self.row, self.col = 0, 0
+        self.terminal = Terminal(self, get_size = lambda: (self.h, self.w))
+        self._blank()
+
+    def _blank(self):
+        self.screen: List[List[str]] = [[' '] * self.w for _ in range(self.h)]
+        self.screen_attrs: List[List[int]] = [[0] * self.w for _ in range(self.h)]
+
+    def text(self) -> List[str]:
+        """ Returns the rows of the screen """
+        return [''.join(row) for row in self.screen]
+
+    def flush(self):
+        self.flushes += 1
+
+    def set_size(self, size: Tuple[int, int]):
+        super().set_size(size)
+        self.h, self.w = size
+        self._blank()
+
+    def _sgr(self, params: str):
+        value = 0
+        for code in (int(code) for code in params.split(';') if code):
+            if code == 1:
+                value |= BOLD
+            elif 30 <= code <= 37:
+                value = (value & ~0xF) | (code - 29)
+            elif 40 <= code <= 47:
+                value = (value & ~0xF0) | ((code - 39) << 4)
+        self.attr = value
+
+    def write(self, data: str):
+        if self.record:
+            self.written.append(data)
+        self.bytes_written += len(data.encode('utf-8'))
+        self.terminal.touch()
+        for params, command, title, newline, text in self.ESCAPE.findall(data):
+            if text:
+                for char in text:
+                    if self.col >= self.w:
+                        self.row, self.col = self.row + 1, 0
+                    if 0 <= self.row < self.h:
+                        self.screen[self.row][self.col] = char
+                        self.screen_attrs[self.row][self.col] = self.attr
+                    self.col += 1
+            elif newline:
+                self.row, self.col = self.row + 1, 0
+            elif title:
+                self.title = title
+            elif command == 'H':
+                row, _, col = params.partition(';')
+                self.row, self.col = int(row or 1) - 1, int(col or 1) - 1
+            elif command == 'J' and params == '2':
+                self._blank()
+            elif command == 'm':
+                self._sgr(params)
+
+class DiffRenderer:
+    """ Remembers what is on the terminal and writes only the cells that changed.\n
+        Tracks the terminal's current attribute, an SGR escape is only written where it changes
+    """
+    def __init__(self, out: TerminalBackend = None):
+        self.out = out if out is not None else TerminalBackend()
+        self.shown: List[str] = []
+        self.shown_attrs: List[array] = []
+        self.attr: int = None
+        self.bytes_written: int = 0
+
+    def invalidate(self):
+        """ Forget the terminal contents, the next render redraws everything """
+        self.shown = []
+        self.shown_attrs = []
+        self.attr = None
+
+    def _put(self, parts: List[str], text: str, attrs: array):
+        """ Adds text to parts, switching attributes only where they change along it """
+        if attrs is None:
+            if self.attr != 0:
+                parts.append(sgr(0))
+                self.attr = 0
+            parts.append(text)
+            return
+        start = 0
+        for value, group in groupby(attrs):
+            stop = start + sum(1 for _ in group)
+            if value != self.attr:
+                parts.append(sgr(value))
+                self.attr = value
+            parts.append(text[start:stop])
+            start = stop
+
+    def diff(self, frame: Frame) -> str:
+        """ Returns the escape string turning the shown frame into frame """
+        rows = [frame.row_string(row) for row in range(frame.h)]
+        attrs = [frame.row_attrs(row) for row in range(frame.h)]
+        parts = []
+        if len(rows) != len(self.shown) or (rows and len(rows[0]) != len(self.shown[0])):
+            self.attr = None
+            parts.append('\x1b[2J')
+            for row, row_str in enumerate(rows):
+                parts.append(cursor_to(row, 0))
+                self._put(parts, row_str, attrs[row])
+        else:
+            for row, row_str in enumerate(rows):
+                old, old_attrs, row_attrs = self.shown[row], self.shown_attrs[row], attrs[row]
+                same_attrs = old_attrs is row_attrs or old_attrs == row_attrs
+                if same_attrs and (old is row_str or old == row_str):
+                    continue
+                if same_attrs:
+                    found = changed_runs(old, row_str)
+                else:
+                    found = changed_runs(old, row_str, old_attrs = old_attrs, new_attrs = row_attrs)
+                for start, stop in found:
+                    parts.append(cursor_to(row, start))
+                    self._put(parts, row_str[start:stop], None if row_attrs is None else row_attrs[start:stop])
+        self.shown = rows
+        self.shown_attrs = attrs
+        if parts:
+            parts.append(cursor_to(frame.h, 0))
+        return ''.join(parts)
+
+    def render(self, frame: Frame) -> int:
+        """ Writes the changes for frame to the terminal, returns the number of characters written """
+        data = self.diff(frame)
+        if data:
+            self.out.write(data)
+            self.out.flush()
+            self.bytes_written += len(data)
+        return len(data)
+
 class Display:
     """ Display and display handling methods """
-    def __init__(self, size: Tuple[int, int], title: str = 'Display.py'):
+    def __init__(self, size: Tuple[int, int], title: str = 'Display.py', backend: TerminalBackend = None):
         self.h, self.w = size
         self.s = size
         self.blank: Frame = Frame(size, False)
-        self.buffer: FrameBuffer = FrameBuffer(5)
-        self.buffer.put(self.blank)
+        self.buffer: FrameBuffer = FrameBuffer(5, front = self.blank)
         self.name = self
+        self.backend = backend if backend is not None else TerminalBackend()
+        self.renderer = DiffRenderer(self.backend)
+        self.received: Frame = None
+        self.received_seq: int = 0
+        self.shared: SharedFrameBuffer = None
         self.apply_size()
         self.apply_title(title)
 
     def apply_size(self):
-        os.system(f'MODE CON: COLS={str(self.w)} LINES={str(self.h)}')
+        self.backend.set_size((self.h, self.w))
 
     def apply_title(self, title: str):
-        os.system(f'title {title}')
+        self.backend.set_title(title)
     
     def size(self) -> Tuple[int, int]:
         return self.s
 
     def resize(self, size: Tuple[int, int]):
         self.h, self.w = size
+        self.s = size
         self.apply_size()
+        self.renderer.invalidate()
 
     def update(self):
-        try:
-            assert self.buffer.len() > 0, 'No Frames in FrameBuffer!'
-        except AssertionError as e:
-            log.debug(e)
-            self.buffer.put(self.blank)
-        print(str(self.buffer.get()))
+        self.renderer.render(self.buffer.get())
+
+    def put_delta(self, delta: FrameDelta):
+        """ Rebuilds the next frame from the last one received and puts it in the buffer """
+        if not delta.keyframe and (self.received is None or delta.base != self.received_seq):
+            log.debug(f'Dropped {delta}, last frame received is {self.received_seq}')
+            return
+        self.received = delta.apply(self.received)
+        self.received_seq = delta.seq
+        self.buffer.put(self.received)
+
+    def put_encoded(self, codec: str, payload: bytes):
+        """ Decodes a frame or delta sent with the codec picked at connect time """
+        from FrameCodec import CODECS
+        item = CODECS[codec].decode(payload)
+        if isinstance(item, FrameDelta):
+            self.put_delta(item)
+            return
+        self.received = item
+        # Deltas were made against some other frame, only a keyframe follows this one
+        self.received_seq = -1
+        self.buffer.put(item)
+
+    def attach_shared(self, name: str):
+        """ Starts reading frames from the game engine's shared memory buffer """
+        if self.shared is not None:
+            self.shared.close()
+        self.shared = SharedFrameBuffer(name = name)
+        self.received = None
+        log.debug(f'Attached {self.shared}')
+
+    def frame_ready(self, seq: int):
+        """ Reads the shared frame in place after the engine says frame seq was written """
+        if self.shared is None:
+            log.debug(f'Frame {seq} ready but no shared buffer is attached')
+            return
+        frame = self.shared.read(self.received)
+        if frame is None:
+            log.debug(f'Shared frame {seq} was being written, skipped')
+            return
+        self.received = frame
+        # seq counts shared writes, not deltas, only a keyframe can follow this frame
+        self.received_seq = -1
+        self.buffer.put(frame)
 
     def clear(self):
-        os.system('cls')
+        self.backend.clear()
+        self.renderer.invalidate()
 
     def print_from_instruction(self, word_list: List[str]):
-        string = ''
-        for word in word_list:
-            string += f'{word} '
-        string.strip()
+        string = ' '.join([str(word) for word in word_list])
         #self.clear()
-        print(string)
+        self.backend.write(f'{string}\n')
+        self.backend.flush()
+        # Printing scrolls the terminal, so the shown frame can't be trusted anymore
+        self.renderer.invalidate()
+
+class FramePacer:
+    """ Renders the display at most once per tick of the target fps.\n
+        update only marks the display as wanting a render, frames put in between
+        ticks replace each other and are counted as skipped
+    """
+    def __init__(self, display: Display, fps: float = 30, report_time: float = 5, clock = time.perf_counter):
+        self.display = display
+        self.clock = clock
+        self.display.buffer.policy = KEEP_NEWEST
+        self.set_fps(fps)
+        self.report_time = report_time
+        self.pending: bool = False
+        self.next_tick: float = self.clock()
+        self.rendered: int = 0
+        self.window_start: float = self.next_tick
+        self.window_rendered: int = 0
+        self.achieved: float = 0.0
+
+    def set_fps(self, fps: float):
+        assert fps > 0, 'Target fps must be above 0'
+        self.fps = fps
+        self.period = 1 / fps
+
+    def update(self):
+        """ Asks for a render on the next tick """
+        self.pending = True
+
+    def wait_time(self) -> float:
+        """ Seconds until the next tick, 0 if it is due """
+        return max(0.0, self.next_tick - self.clock())
+
+    def skipped(self) -> int:
+        """ Frames that were replaced before they could be shown """
+        return self.display.buffer.dropped
+
+    def tick(self):
+        """ Renders if a render is pending and the tick is due """
+        now = self.clock()
+        if now < self.next_tick:
+            return
+        if self.pending:
+            self.display.update()
+            self.pending = False
+            self.rendered += 1
+            self.window_rendered += 1
+        # Ticks missed during a slow render are skipped, not caught up in a burst
+        self.next_tick += self.period * (int((now - self.next_tick) / self.period) + 1)
+        elapsed = now - self.window_start
+        if elapsed >= self.report_time:
+            self.achieved = self.window_rendered / elapsed
+            self.window_start = now
+            self.window_rendered = 0
+            log.info(self.report())
+
+    def stats(self) -> Dict[str, float]:
+        return {'target_fps': self.fps, 'fps': self.achieved,
+                'rendered': self.rendered, 'skipped': self.skipped()}
+
+    def report(self) -> str:
+        return f'{self.achieved:.1f}/{self.fps} fps, {self.rendered} rendered, {self.skipped()} skipped'
 
 def hide_logs():
     log.setLevel(logging.CRITICAL)
@@ -221,17 +1703,31 @@ if __name__ == '__main__':
         with Listener(address) as listener:
             conn = listener.accept()
             log.info(f'Connection accepted from {listener.last_accepted}')
-        size, title = conn.recv()
+        from FrameCodec import negotiate
+        handshake = conn.recv()
+        size, title = handshake[:2]
+        if len(handshake) > 2:
+            conn.send(negotiate(handshake[2]))
         display = Display(size, title)
+        pacer = FramePacer(display)
 
         TASK = {
         'putFrame': display.buffer.put,
-        'update': display.update,
+        'putDelta': display.put_delta,
+        'putEncoded': display.put_encoded,
+        'attachShared': display.attach_shared,
+        'frameReady': display.frame_ready,
+        'update': pacer.update,
+        'setFps': pacer.set_fps,
+        'frameStats': lambda: display.print_from_instruction([pacer.report()]),
         'resize': display.resize,
         'clearBuffer': display.buffer.clear,
         'print': display.print_from_instruction,
         'clear': display.clear,
-        'hideLogs': hide_logs
+        'hideLogs': hide_logs,
+        # Passed on to the engine, which subscribes this display to the topic
+        'subscribe': lambda topic: conn.send_bytes(pack([Instruction('subscribe', (topic, ), 'displayEngine')])),
+        'unsubscribe': lambda topic: conn.send_bytes(pack([Instruction('unsubscribe', (topic, ), 'displayEngine')])),
         }
         
         def instruction_handle(instruction: Instruction):
@@ -249,8 +1745,10 @@ if __name__ == '__main__':
         log.setLevel(logging.DEBUG)
         Display
         while True:
-            instruction = conn.recv()
-            instruction_handle(instruction)
+            if conn.poll(pacer.wait_time()):
+                for instruction in unpack(conn.recv_bytes()):
+                    instruction_handle(instruction)
+            pacer.tick()
     
     except ConnectionResetError:
         log.debug('Exiting...')
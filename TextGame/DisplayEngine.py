@@ -8,40 +8,79 @@ Code for routing Intsructions and creating Frames to be displayed
 """
 version_info = 'v0.4'
 
+from Display import FrameDelta, SharedFrameBuffer
+from FrameCodec import CODECS, codec_names
 from Instruction import *
+from Instruction import encode, pack_encoded
+import asyncio
+from functools import partial
 import logging
-from ctypes import c_bool
-from multiprocessing import Value, get_context
-from multiprocessing.connection import Client, Connection, wait
-from multiprocessing.context import Process
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Connection
 from multiprocessing.queues import Queue
-from queue import Empty, Full
+from queue import Empty
 import os
-import time
-from typing import List, Tuple
+import re
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Tuple
 
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# kind and number of an endpoint name, display3, input12, game, display* (every display)
+ENDPOINT = re.compile(r'(display|input|game)(\d+|\*)?')
+
 class Instance:
-    """ An instance of the game engine """
-    def __init__(self, title: str, screen_size: Tuple[int, int], queue: Queue, clock_time: float, max_displays: int):
+    """ An instance of the game engine.\n
+        Instructions are routed by an asyncio loop that wakes when an input or display
+        connection has something to read, or when instruction_put hands it an instruction
+        from any thread. Nothing polls, an idle router uses no CPU.\n
+        A destination is resolved to its endpoints the first time it's seen and looked up
+        in routes after that. Destinations can be endpoints (display10, input0, game1),
+        every endpoint of a kind (display*, input*, game*), groups made with add_group
+        or topics (frames/main, status). An instruction sent to a topic is encoded once
+        and the same bytes go to every subscriber
+    """
+    def __init__(self, title: str, screen_size: Tuple[int, int], queue: Queue, clock_time: float, max_displays: int,
+                 batch_count: int = 64, batch_bytes: int = 1 << 16, batch_delay: float = 0.0):
+        # clock_time was the polling interval, kept so callers don't break, nothing polls anymore
         self.__path = os.getcwd()
         log.info(f'cwd is {self.__path}')
         self.max_d = max_displays
-        self.wait = clock_time
         self.d_count: int = 0
         self.i_count: int = 0
         self.displays: List[Connection] = []
         self.inputs: List[Connection] = []
         self.size = screen_size
         self.title = title
-        self.run: c_bool = Value(c_bool, True)
-        ctx = get_context()
-        self.queue = Queue(20, ctx = ctx)
+        # Set by stop, the router doesn't start (or start again) after it
+        self.stopped: bool = False
         self.parent_queue = queue
-        log.debug('Queue started...')
+        # Every game consumer, game and game0 are the queue the Instance was made with
+        self.games: List[Queue] = [queue]
+        self.groups: Dict[str, List[str]] = {}
+        self.topics: Dict[str, List[str]] = {}
+        self.published: int = 0
+        self.routes: Dict[str, List[Callable[[Instruction], None]]] = {}
+        self.senders: Dict[Connection, Callable[[Instruction], None]] = {}
+        self.loop: asyncio.AbstractEventLoop = None
+        self.router: Thread = None
+        # Instructions put before the router started, handled as soon as it does
+        self.pending: List[Instruction] = []
+        self.pending_lock = Lock()
+        # Encoded instructions for each connection wait here until the end of the router tick,
+        # then go as one batch. A batch over batch_count or batch_bytes goes straight away
+        self.outbox: Dict[Connection, List[bytes]] = {}
+        self.outbox_bytes: Dict[Connection, int] = {}
+        self.batch_count = batch_count
+        self.batch_bytes = batch_bytes
+        self.batch_delay = batch_delay
+        self.flush_scheduled = False
+        self.batches_sent: int = 0
+        self.instructions_sent: int = 0
+        self.shared: Dict[str, SharedFrameBuffer] = {}
+        self.codecs: Dict[str, str] = {}
 
     def create_UI(self, ui: str):
         """ Starts a new python interpreter running the input ui program """ 
@@ -52,11 +91,87 @@ class Instance:
         address = ('localhost', port)
         auth = authkey       
         if io == 'displays':
-            self.displays.append(Client(address))
+            conn = Client(address)
+            self.displays.append(conn)
             self.d_count += 1
         if io == 'inputs':
-            self.inputs.append(Client(address))
+            conn = Client(address)
+            self.inputs.append(conn)
             self.i_count += 1
+        self.watch(conn)
+
+    def watch(self, conn: Connection):
+        """ Has a running router read conn, and forgets routes that could now go somewhere else """
+        self.routes = {}
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.add_reader, conn.fileno(), self.connection_ready, conn)
+
+    def add_game(self, queue: Queue) -> str:
+        """ Adds another game consumer, returns its destination name """
+        self.games.append(queue)
+        self.routes = {}
+        return f'game{len(self.games) - 1}'
+
+    def add_group(self, name: str, members: List[str]):
+        """ Makes name a destination sending to every member, members can be groups too """
+        assert ENDPOINT.fullmatch(name) is None and name != 'displayEngine', f'{name} is an endpoint name'
+        assert name not in self.topics, f'{name} is a topic'
+        self.groups[name] = list(members)
+        self.routes = {}
+
+    def subscribe(self, topic: str, endpoint: str):
+        """ Sends endpoint (or every endpoint of a group) everything published to topic.\n
+            Changes the routes, once the router is running send a subscribe instruction to displayEngine instead
+        """
+        assert ENDPOINT.fullmatch(topic) is None and topic not in self.groups, f'{topic} is already a destination'
+        subscribers = self.topics.setdefault(topic, [])
+        if endpoint not in subscribers:
+            subscribers.append(endpoint)
+        self.routes = {}
+        self.codecs[topic] = self.topic_codec(topic)
+        log.debug(f'{endpoint} subscribed to {topic}')
+
+    def unsubscribe(self, topic: str, endpoint: str):
+        subscribers = self.topics.get(topic, [])
+        if endpoint in subscribers:
+            subscribers.remove(endpoint)
+        self.routes = {}
+        self.codecs[topic] = self.topic_codec(topic)
+
+    def topic_codec(self, topic: str) -> str:
+        """ Returns the codec every subscriber of topic picked, None if they didn't all pick the same """
+        names = {self.codecs.get(endpoint) for endpoint in self.topics.get(topic, [])}
+        return names.pop() if len(names) == 1 else None
+
+    def publish(self, topic: str, task: str, args: Tuple = None):
+        self.instruction_put(Instruction(task, args, topic))
+
+    def share_frames(self, display: str = 'display0') -> SharedFrameBuffer:
+        """ Creates a shared memory frame buffer for display and tells it to attach.\n
+            Frames are then written straight into it and only a 'frameReady' notice is sent
+        """
+        if display not in self.shared:
+            self.shared[display] = SharedFrameBuffer(self.size)
+            self.instruction_put(Instruction('attachShared', (self.shared[display].name, ), display))
+        return self.shared[display]
+
+    def send_frame(self, delta: FrameDelta, display: str = 'display0'):
+        """ Sends delta encoded with the codec display picked at connect time """
+        name = self.codecs.get(display)
+        if name is None:
+            self.instruction_put(Instruction('putDelta', (delta, ), display))
+            return
+        self.instruction_put(Instruction('putEncoded', (name, CODECS[name].encode(delta)), display))
+
+    def put_shared_frame(self, frame, display: str = 'display0'):
+        """ Writes frame into display's shared buffer and tells the display it's ready """
+        seq = self.share_frames(display).write(frame)
+        self.instruction_put(Instruction('frameReady', (seq, ), display))
+
+    def close_shared(self):
+        for shared in self.shared.values():
+            shared.close()
+        self.shared = {}
 
     def default_start(self, inputs_init = dict()):
         log.info('Default start...')
@@ -66,90 +181,215 @@ class Instance:
         log.debug('display connected...')
         self.connect('displays', 1000)
         log.debug('input connected...')
-        self.displays[0].send((self.size, self.title))
+        self.displays[0].send((self.size, self.title, codec_names()))
+        self.codecs['display0'] = self.displays[0].recv()
+        log.debug(f'display0 picked codec {self.codecs["display0"]}')
         self.inputs[0].send(inputs_init)
         log.debug('Sent input test')
-        get = Process(target = self.instruction_loop, args = (self.queue, ))
-        get.start()
+        self.router = Thread(target = self.start, name = 'router', daemon = True)
+        self.router.start()
 
     def start(self):
-        self.instruction_loop()
+        """ Routes instructions until stop, in the calling thread """
+        if self.loop is not None:
+            log.debug('Router already running')
+            return
+        # Selector loops can watch sockets on every platform, add_reader needs one
+        loop = asyncio.SelectorEventLoop()
+        for conn in self.inputs + self.displays:
+            loop.add_reader(conn.fileno(), self.connection_ready, conn)
+        with self.pending_lock:
+            if self.stopped:
+                log.debug('Router stopped before it started')
+                loop.close()
+                return
+            self.loop = loop
+            for instruction in self.pending:
+                loop.call_soon(self.instruction_handle, instruction)
+            self.pending = []
+        log.debug('Router starting...')
+        try:
+            loop.run_forever()
+        finally:
+            with self.pending_lock:
+                self.loop = None
+            loop.close()
+        log.info('Exiting router...')
 
     def stop(self):
-        self.run.value = False
+        with self.pending_lock:
+            self.stopped = True
+            loop = self.loop
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        self.close_shared()
 
     def hide_logs(self):
         log.setLevel(logging.CRITICAL)
-        for input in range(len(self.inputs)):
-            self.instruction_put(Instruction('hideLogs', to = f'input{input}'))
-        for display in range(len(self.displays)):
-            self.instruction_put(Instruction('hideLogs', to = f'display{display}'))
-
-    def instruction_loop(self, queue: Queue):
-        log.debug('Instruction loop starting...')
-        while self.run.value == True:
-            try:
-                self.input_get(queue)
-                instruction = queue.get(True, self.wait)
-                self.instruction_handle(instruction)
-            except Empty:
-                #log.debug('Queue is empty...')
-                continue
-        log.info('Exiting instruction loop...')
+        self.instruction_put(Instruction('hideLogs', to = 'input*'))
+        self.instruction_put(Instruction('hideLogs', to = 'display*'))
+
+    def engine_task(self, instruction: Instruction):
+        task = instruction.get_task()
+        if task == 'stop':
+            self.stop()
+        elif task == 'start':
+            self.start()
+        elif task == 'subscribe':
+            self.subscribe(*instruction.get_args())
+            # Lets the game start the new subscriber off with a keyframe
+            self.instruction_handle(Instruction('subscribed', instruction.get_args(), 'game'))
+        elif task == 'unsubscribe':
+            self.unsubscribe(*instruction.get_args())
+
+    def endpoint_name(self, conn: Connection) -> str:
+        if conn in self.displays:
+            return f'display{self.displays.index(conn)}'
+        return f'input{self.inputs.index(conn)}'
+
+    def sender(self, conn: Connection) -> Callable[[Instruction], None]:
+        """ Returns the one function sending to conn, so routes can tell endpoints apart """
+        sender = self.senders.get(conn)
+        if sender is None:
+            sender = self.senders[conn] = partial(self.send, conn)
+        return sender
+
+    def build_route(self, destination: str, seen: Tuple[str] = ()) -> List[Callable[[Instruction], None]]:
+        """ Returns what handles instructions sent to destination, one call per endpoint """
+        if destination == 'displayEngine':
+            return [self.engine_task]
+        if destination in self.groups:
+            assert destination not in seen, f'Group {destination} contains itself'
+            route = []
+            for member in self.groups[destination]:
+                for target in self.build_route(member, seen + (destination, )):
+                    if target not in route:
+                        route.append(target)
+            return route
+        if destination in self.topics:
+            connections, others = [], []
+            for member in self.topics[destination]:
+                for target in self.build_route(member, seen):
+                    if isinstance(target, partial) and target.func == self.send:
+                        if target.args[0] not in connections:
+                            connections.append(target.args[0])
+                    elif target not in others:
+                        others.append(target)
+            return [partial(self.fan_out, connections, others)]
+        match = ENDPOINT.fullmatch(destination)
+        if match is None:
+            log.debug(f'Did not recognize destination {destination}')
+            return []
+        kind, num = match.groups()
+        if kind == 'game':
+            endpoints = [queue.put for queue in self.games]
+        else:
+            connections = self.displays if kind == 'display' else self.inputs
+            endpoints = [self.sender(conn) for conn in connections]
+        if num == '*':
+            return endpoints
+        num = int(num or 0)
+        if num >= len(endpoints):
+            log.debug(f'No {kind} {num} connected')
+            return []
+        return [endpoints[num]]
 
     def instruction_handle(self, instruction: Instruction):
         """ Sends instructions to and from where they need to go """
         assert isinstance(instruction, Instruction), f'Cannot handle {type(instruction)}'
         destination = instruction.destination()
-        log.debug(destination)
-        log.debug(instruction)
-        if 'input' in destination:
-            num = int(destination[-1])
-            self.inputs[num].send(instruction)
-            log.debug(f'Sent to input {num}')
-            return
-        if 'displayEngine' in destination:
-            task = instruction.get_task()
-            if task == 'stop':
-                self.stop()
-                return
-            if task == 'start':
-                self.start()
-                return
-        if 'display' in destination:
-            num = int(destination[-1])
-            self.displays[num].send(instruction)
-            log.debug(f'Sent to display {num}')
+        route = self.routes.get(destination)
+        if route is None:
+            route = self.build_route(destination)
+            self.routes[destination] = route
+            log.debug(f'Routing {destination} to {len(route)} endpoints')
+        for target in route:
+            target(instruction)
+
+    def fan_out(self, connections: List[Connection], others: List[Callable[[Instruction], None]], instruction: Instruction):
+        """ Sends instruction to every subscriber of a topic, encoded once for all the connections """
+        if connections:
+            message = bytes(encode(instruction))
+            for conn in connections:
+                self.queue_message(conn, message)
+        for target in others:
+            target(instruction)
+        self.published += 1
+
+    def send(self, conn: Connection, instruction: Instruction):
+        """ Queues instruction for conn, everything queued for it in one router tick is sent together """
+        self.queue_message(conn, bytes(encode(instruction)))
+
+    def queue_message(self, conn: Connection, message: bytes):
+        """ Queues an instruction already run through encode for conn """
+        if self.loop is None:
+            conn.send_bytes(pack_encoded([message]))
             return
-        if 'game' in destination:
-            self.parent_queue.put(instruction)
-            log.debug(f'Sent to game')
-            log.debug(instruction.get())
+        batch = self.outbox.setdefault(conn, [])
+        batch.append(message)
+        self.outbox_bytes[conn] = self.outbox_bytes.get(conn, 0) + len(message)
+        if len(batch) >= self.batch_count or self.outbox_bytes[conn] >= self.batch_bytes:
+            self.flush(conn)
             return
-        log.debug(f'Did not recognize destination {destination}')        
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_later(self.batch_delay, self.flush_all)
 
-    def input_get(self, queue):
-        connection = wait(self.inputs, self.wait)
-        #log.debug(f'Connections ready: {connection}')
+    def flush(self, conn: Connection):
+        """ Sends what is queued for conn as one packed message """
+        batch = self.outbox.pop(conn, None)
+        self.outbox_bytes.pop(conn, None)
+        if not batch:
+            return
         try:
-            for conn in connection:
-                queue.put(conn.recv())
+            conn.send_bytes(pack_encoded(batch))
+        except (EOFError, OSError) as e:
+            log.debug((e, 'dropped batch'))
+            return
+        self.batches_sent += 1
+        self.instructions_sent += len(batch)
+
+    def flush_all(self):
+        self.flush_scheduled = False
+        for conn in list(self.outbox):
+            self.flush(conn)
+
+    def connection_ready(self, conn: Connection):
+        """ Routes everything waiting on conn, called by the router when it becomes readable """
+        while True:
+            try:
+                if not conn.poll():
+                    return
+                received = conn.recv_bytes()
+            except (EOFError, OSError) as e:
+                log.debug((e, 'connection closed'))
+                self.loop.remove_reader(conn.fileno())
+                return
+            try:
+                instructions = unpack(received)
+            except Exception as e:
+                log.debug((e, 'dropped unreadable message'))
                 continue
-        except IndexError:
-            log.debug('No instructions received...')
-        except Exception as e:
-            log.debug(e)
-    
+            # One bad instruction only loses itself, not the rest of its batch
+            for instruction in instructions:
+                try:
+                    args = instruction.get_args()
+                    if instruction.get_task() in ('subscribe', 'unsubscribe') and args is not None and len(args) == 1:
+                        # Sent by the endpoint itself, it subscribes as itself
+                        instruction.set_args((args[0], self.endpoint_name(conn)))
+                    self.instruction_handle(instruction)
+                except Exception as e:
+                    log.debug((e, f'dropped {instruction}'))
+
     def instruction_put(self, instruction: Instruction):
+        """ Hands instruction to the router, safe to call from any thread """
         assert isinstance(instruction, Instruction), f'{instruction} is not Instruction'
-        log.debug('Putting instruction in queue...')
-        try:
-            self.queue.put(instruction)
-        except Exception as e:
-            log.debug(e)
-            return
-        finally:
-            log.debug('Instruction put!')
+        with self.pending_lock:
+            if self.loop is None:
+                self.pending.append(instruction)
+                log.debug('Router not running, instruction kept')
+                return
+            self.loop.call_soon_threadsafe(self.instruction_handle, instruction)
 
 if __name__ == '__main__':
     log.setLevel(logging.CRITICAL)
@@ -162,5 +402,4 @@ if __name__ == '__main__':
     new_instruction = Instruction(task = 'getFromPrompt', args = ('Input: ', 'display0'), to = 'input0')
     game.instruction_put(new_instruction)
     log.debug('new instruction sent')
-    while True:
-        continue
\ No newline at end of file
+    game.router.join()
\ No newline at end of file
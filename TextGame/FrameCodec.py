@@ -0,0 +1,199 @@
+"""
+Frame Codec v0.4
+
+Author  : Christian Carter
+Date    : 18 Oct 2026
+
+Compact encodings for Frames and FrameDeltas sent between the game engine and displays
+"""
+version_info = 'v0.4'
+
+from array import array
+from Display import Frame, FrameDelta, glyph_array
+import logging
+import re
+from struct import Struct
+import sys
+import time
+from typing import Dict, List, Union
+import zlib
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+class CodecError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+# A run is written as RUN, chr(length), char. RUN never shows up as a literal,
+# it is always written as a run, so decoding is unambiguous
+RUN = '\0'
+# Longest run written at once, chr of anything above hits the surrogates UTF-8 can't encode
+MAX_RUN = 0xD7FF
+RUN_FIND = re.compile(f'([^{RUN}])\\1{{3,{MAX_RUN - 1}}}|({RUN}){{1,{MAX_RUN}}}', re.DOTALL)
+RUN_EXPAND = re.compile(f'{RUN}(.)(.)', re.DOTALL)
+
+FRAME_HEADER = Struct('<cIIB')        # type, h, w, has attributes
+DELTA_HEADER = Struct('<cQQIIBI')     # type, seq, base, h, w, keyframe, run count
+DELTA_RUN = Struct('<IIIB')           # row, col, length, has attributes
+
+def _run(match) -> str:
+    text = match[0]
+    return f'{RUN}{chr(len(text))}{text[0]}'
+
+def _expand(match) -> str:
+    return match[2] * ord(match[1])
+
+def rle_encode(text: str) -> str:
+    """ Run length encodes one row, runs of 4 or more of the same char are shortened """
+    return RUN_FIND.sub(_run, text)
+
+def rle_decode(text: str) -> str:
+    return RUN_EXPAND.sub(_expand, text)
+
+# Attributes are below 0x200, so every uint16 maps to one UTF-16 code unit
+# and the attribute plane run length encodes just like a row of glyphs
+def attrs_to_text(attrs: array) -> str:
+    if sys.byteorder == 'big':
+        attrs = array('H', attrs)
+        attrs.byteswap()
+    return attrs.tobytes().decode('utf-16-le')
+
+def text_to_attrs(text: str) -> array:
+    attrs = array('H', text.encode('utf-16-le'))
+    if sys.byteorder == 'big':
+        attrs.byteswap()
+    return attrs
+
+class Codec:
+    """ Turns Frames and FrameDeltas into bytes and back """
+    name = 'rle'
+
+    def pack(self, data: bytes) -> bytes:
+        """ Last encoding stage, subclasses compress here """
+        return data
+
+    def unpack(self, data: bytes) -> bytes:
+        return data
+
+    def encode(self, item: Union[Frame, FrameDelta]) -> bytes:
+        # Glyphs first, then the attributes of whatever has them
+        if isinstance(item, FrameDelta):
+            head = [DELTA_HEADER.pack(b'D', item.seq, item.base, item.size[0], item.size[1], item.keyframe, len(item.runs))]
+            body = []
+            colour = []
+            for row, col, text, attrs in item.runs:
+                head.append(DELTA_RUN.pack(row, col, len(text), attrs is not None))
+                body.append(rle_encode(text))
+                if attrs is not None:
+                    colour.append(rle_encode(attrs_to_text(attrs)))
+            body.extend(colour)
+        elif isinstance(item, Frame):
+            head = [FRAME_HEADER.pack(b'F', item.h, item.w, item.attrs is not None)]
+            body = [rle_encode(item.row_string(row)) for row in range(item.h)]
+            if item.attrs is not None:
+                body.extend(rle_encode(attrs_to_text(item.row_attrs(row))) for row in range(item.h))
+        else:
+            raise CodecError(f'Can\'t encode {type(item)}')
+        return self.pack(b''.join(head) + ''.join(body).encode('utf-8'))
+
+    def decode(self, payload: bytes) -> Union[Frame, FrameDelta]:
+        data = self.unpack(payload)
+        kind = data[:1]
+        if kind == b'F':
+            _, h, w, colour = FRAME_HEADER.unpack_from(data, 0)
+            text = rle_decode(str(data[FRAME_HEADER.size:], 'utf-8'))
+            cells = h * w
+            if len(text) != cells * (2 if colour else 1):
+                raise CodecError(f'Frame payload holds {len(text)} cells, expected {cells}')
+            attrs = text_to_attrs(text[cells:]) if colour else None
+            return Frame((h, w), glyphs = glyph_array(text[:cells]), attrs = attrs)
+        if kind == b'D':
+            _, seq, base, h, w, keyframe, count = DELTA_HEADER.unpack_from(data, 0)
+            offset = DELTA_HEADER.size
+            spans = []
+            for _ in range(count):
+                spans.append(DELTA_RUN.unpack_from(data, offset))
+                offset += DELTA_RUN.size
+            text = rle_decode(str(data[offset:], 'utf-8'))
+            runs = []
+            start = 0
+            attr_start = sum(length for row, col, length, colour in spans)
+            for row, col, length, colour in spans:
+                attrs = None
+                if colour:
+                    attrs = text_to_attrs(text[attr_start:attr_start + length])
+                    attr_start += length
+                runs.append((row, col, text[start:start + length], attrs))
+                start += length
+            if attr_start != len(text):
+                raise CodecError(f'Delta payload holds {len(text)} cells, runs cover {attr_start}')
+            return FrameDelta(seq, base, (h, w), runs, bool(keyframe))
+        raise CodecError(f'Unknown payload type {kind}')
+
+# Preset dictionary for the zlib stage, the glyph runs station scenes are made of
+ZDICT = ''.join([rle_encode(' ' * 180), rle_encode('=' * 80), rle_encode('|' * 40), rle_encode('#' * 8),
+                 '||  ||  ==  ##  ']).encode('utf-8')
+
+class ZlibCodec(Codec):
+    """ Run length encoding followed by zlib with a preset dictionary """
+    name = 'rle+zlib'
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def pack(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(self.level, zdict = ZDICT)
+        return compressor.compress(data) + compressor.flush()
+
+    def unpack(self, data: bytes) -> bytes:
+        decompressor = zlib.decompressobj(zdict = ZDICT)
+        return decompressor.decompress(data) + decompressor.flush()
+
+CODECS: Dict[str, Codec] = {codec.name: codec for codec in (ZlibCodec(), Codec())}
+
+def codec_names() -> List[str]:
+    """ Codec names in order of preference, offered by the game engine at connect time """
+    return list(CODECS.keys())
+
+def negotiate(offered: List[str]) -> str:
+    """ Picks the first offered codec this side knows, None if there are none """
+    for name in offered:
+        if name in CODECS:
+            return name
+    return None
+
+def benchmark(frame: Frame, repeat: int = 200):
+    """ Prints size and encode/decode throughput of every codec for frame """
+    import pickle
+    plain = len(pickle.dumps(frame))
+    cells = frame.h * frame.w
+    print(f'{frame.h}x{frame.w} frame, pickled: {plain} bytes')
+    for codec in CODECS.values():
+        payload = codec.encode(frame)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            codec.encode(frame)
+        encode = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        for _ in range(repeat):
+            codec.decode(payload)
+        decode = (time.perf_counter() - start) / repeat
+        print(f'{codec.name:>9}: {len(payload):6} bytes ({plain / len(payload):5.1f}x smaller), '
+              f'encode {cells / encode / 1e6:6.1f} Mcells/s, decode {cells / decode / 1e6:6.1f} Mcells/s')
+
+if __name__ == '__main__':
+    from Display import Scene, Sprite, log as display_log
+    display_log.setLevel(logging.CRITICAL)
+    for size in ((40, 70), (50, 180), (200, 600)):
+        scene = Scene(size, [])
+        h, w = size
+        for sprite in (Sprite((1, w - 2), '=', (1, 1)), Sprite((1, w - 2), '=', (1, h - 2)),
+                       Sprite((h - 4, 1), '|', (1, 2)), Sprite((h - 4, 1), '|', (w - 2, 2)),
+                       Sprite((1, 1), '#', (w // 2, h // 2)), Sprite((1, 1), 'J', (3, 3))):
+            scene.put_sprite(sprite)
+        benchmark(scene)
@@ -14,6 +14,7 @@ from multiprocessing import Process, Value, get_context
 from multiprocessing.connection import Connection, Listener, wait
 from multiprocessing.queues import Queue
 from Instruction import *
+from Terminal import Terminal
 import logging
 import os
 import time
@@ -25,6 +26,7 @@ log.setLevel(logging.INFO)
 
 busy: c_bool = Value(c_bool, False)
 run: c_bool = Value(c_bool, True)
+terminal = Terminal()
 
 class InputInterupt(Exception):
     def __init__(self):
@@ -37,11 +39,13 @@ VALID_INSTRUCTION = ['print', 'clear', 'fill', 'stop']
 
 def cls():
     """ Clears the terminal """
-    os.system('cls')
+    terminal.clear()
 
 def get_input(message: str):
     """ Get input from the terminal """
     log.debug('Getting input...')
+    # The prompt and what was typed moved the cursor
+    terminal.touch()
     return input(message)
 
 def check_input(input: str, instruction_set = VALID_INSTRUCTION, message: str = 'Input: '):
@@ -83,7 +87,8 @@ def instruction_get(send_queue: Queue, connection: List[Connection], busy_bool:
         try:
             log.debug('trying...')
             try:
-                instruction: Instruction = conn[0].recv()
+                # The router sends several instructions at once as a batch
+                instructions: List[Instruction] = unpack(conn[0].recv_bytes())
                 log.debug(conn)
             except ConnectionResetError:
                 log.debug('Exiting...')
@@ -92,11 +97,11 @@ def instruction_get(send_queue: Queue, connection: List[Connection], busy_bool:
                 quit()
             except Exception as e:
                 log.debug(e)
-            log.debug(instruction)
+            log.debug(instructions)
             log.debug(busy)
             log.debug('testing if busy true')
             if busy == True:
-                queue.append(instruction)
+                queue.extend(instructions)
                 log.debug('Instruction queue appended')
                 continue
             log.debug('testing if busy false')
@@ -104,15 +109,13 @@ def instruction_get(send_queue: Queue, connection: List[Connection], busy_bool:
                 log.debug('busy is false')
                 try:
                     log.debug('Trying to put instruction on queue...')
-                    if len(queue) > 0:
-                        log.debug('Grabbing instruction from local queue')
-                        queue.append(instruction)
-                        log.debug('Instruction queue appended...')
-                        send_queue.put(queue.pop(0), timeout = 0.1)
+                    queue.extend(instructions)
+                    # In the order they were sent, whatever doesn't fit waits for the next pass
+                    while len(queue) > 0:
+                        send_queue.put(queue[0], timeout = 0.1)
+                        queue.pop(0)
                         log.debug('Instruction sent...')
-                        continue
-                    send_queue.put(instruction, timeout = 0.1)
-                    log.debug(f'Put instruction on queue\n{send_queue}')
+                    log.debug(f'Put instructions on queue\n{send_queue}')
                     continue
                 except Full:
                     log.debug('Queue is full!')
@@ -132,7 +135,7 @@ def instruction_get(send_queue: Queue, connection: List[Connection], busy_bool:
             continue
 
 def change_title(new_title: str):
-    os.system(f'title {new_title}')
+    terminal.set_title(new_title)
 
 def hide_logs():
     log.setLevel(logging.CRITICAL)
@@ -151,7 +154,7 @@ if __name__ == '__main__':
         instruction = check_input(instruction, instruction_set, message)
         instruction = create_instruction(instruction, to)
         log.debug('Input retrieved!')
-        conn.send(instruction)
+        conn.send_bytes(pack([instruction]))
         log.debug('Input sent!')
         busy.value = False
     
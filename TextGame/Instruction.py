@@ -8,9 +8,17 @@ Instructions to be sent to and from the game engine
 """
 version_info = 'v0.4'
 
-from typing import Any, Tuple
+import pickle
+from struct import Struct
+import time
+from typing import Any, Dict, List, Tuple
+
+# What 'from Instruction import *' gives, the wire format itself stays behind pack and unpack
+__all__ = ['Instruction', 'TASKS', 'DESTINATIONS', 'pack', 'unpack']
 
 class Instruction(object):
+    """ A task, its args and where it goes. Sent between processes with pack and unpack """
+    __slots__ = ('to', 'task', 'args')
 
     def __init__(self, task: str, args: Tuple = None, to: str = 'displayEngine'):
         self.to = to
@@ -39,4 +47,174 @@ class Instruction(object):
         self.args = args
 
     def get(self) -> Tuple[str, Tuple]:
-        return self.get_task(), self.get_args()
\ No newline at end of file
+        return self.get_task(), self.get_args()
+
+# Shared registry interning task and destination names to one byte on the wire.
+# Only ever append, both ends of a connection must agree on the numbers. 0 means the name follows inline
+TASKS = ('stop', 'start', 'update', 'putFrame', 'putDelta', 'putEncoded', 'attachShared', 'frameReady',
+         'setFps', 'frameStats', 'resize', 'clearBuffer', 'print', 'clear', 'hideLogs', 'getFromPrompt',
+         'changeTitle', 'putSprite', 'makeSprite', 'makeCharacter', 'makeWall', 'makeAnimation',
+         'listSprites', 'moveCharacter', 'setView', 'moveCamera', 'followCharacter', 'subscribe',
+         'unsubscribe', 'subscribed')
+DESTINATIONS = ('displayEngine', 'game') + tuple(f'display{num}' for num in range(8)) + tuple(f'input{num}' for num in range(8))
+TASK_IDS: Dict[str, int] = {name: num + 1 for num, name in enumerate(TASKS)}
+DESTINATION_IDS: Dict[str, int] = {name: num + 1 for num, name in enumerate(DESTINATIONS)}
+
+# task id, destination id, arg count (NO_ARGS when args is None)
+HEADER = Struct('<BBB')
+NO_ARGS = 0xFF
+LENGTH = Struct('<I')
+INT = Struct('<q')
+FLOAT = Struct('<d')
+BATCH = Struct('<H')
+# Arg type tags, anything else is pickled
+NONE, FALSE, TRUE, INT_TAG, FLOAT_TAG, STR_TAG, BYTES_TAG, PICKLE_TAG = range(8)
+
+def _pack_name(name: str, ids: Dict[str, int], out: bytearray) -> int:
+    num = ids.get(name, 0)
+    if num == 0:
+        data = name.encode('utf-8')
+        out += LENGTH.pack(len(data))
+        out += data
+    return num
+
+def _pack_arg(arg, out: bytearray):
+    kind = type(arg)
+    if arg is None:
+        out.append(NONE)
+    elif kind is bool:
+        out.append(TRUE if arg else FALSE)
+    elif kind is int and -(1 << 63) <= arg < (1 << 63):
+        out.append(INT_TAG)
+        out += INT.pack(arg)
+    elif kind is float:
+        out.append(FLOAT_TAG)
+        out += FLOAT.pack(arg)
+    elif kind is str:
+        data = arg.encode('utf-8')
+        out.append(STR_TAG)
+        out += LENGTH.pack(len(data))
+        out += data
+    elif kind is bytes:
+        out.append(BYTES_TAG)
+        out += LENGTH.pack(len(arg))
+        out += arg
+    else:
+        data = pickle.dumps(arg, pickle.HIGHEST_PROTOCOL)
+        out.append(PICKLE_TAG)
+        out += LENGTH.pack(len(data))
+        out += data
+
+def encode(instruction: Instruction, out: bytearray = None) -> bytearray:
+    """ Appends instruction in the wire format to out (a new bytearray by default) and returns it """
+    if out is None:
+        out = bytearray()
+    start = len(out)
+    out += bytes(HEADER.size)
+    # Inline names come straight after the header, task first
+    task = _pack_name(instruction.task, TASK_IDS, out)
+    to = _pack_name(instruction.to, DESTINATION_IDS, out)
+    args = instruction.args
+    if args is None:
+        count = NO_ARGS
+    else:
+        if not isinstance(args, tuple):
+            # Spread by TASK[task](*args) the same as a tuple would be
+            args = tuple(args)
+        assert len(args) < NO_ARGS, 'Too many args'
+        count = len(args)
+        for arg in args:
+            _pack_arg(arg, out)
+    HEADER.pack_into(out, start, task, to, count)
+    return out
+
+def _read_name(names: Tuple[str], num: int, data: bytes, pos: int) -> Tuple[str, int]:
+    if num:
+        return names[num - 1], pos
+    length, = LENGTH.unpack_from(data, pos)
+    pos += LENGTH.size
+    return data[pos:pos + length].decode('utf-8'), pos + length
+
+def decode(data, pos: int = 0) -> Tuple[Instruction, int]:
+    """ Reads the instruction encoded at pos in data, returns it and the position after it """
+    task, to, count = HEADER.unpack_from(data, pos)
+    pos += HEADER.size
+    task, pos = _read_name(TASKS, task, data, pos)
+    to, pos = _read_name(DESTINATIONS, to, data, pos)
+    if count == NO_ARGS:
+        return Instruction(task, None, to), pos
+    args = []
+    for _ in range(count):
+        tag = data[pos]
+        pos += 1
+        if tag == NONE:
+            args.append(None)
+        elif tag == FALSE or tag == TRUE:
+            args.append(tag == TRUE)
+        elif tag == INT_TAG:
+            args.append(INT.unpack_from(data, pos)[0])
+            pos += INT.size
+        elif tag == FLOAT_TAG:
+            args.append(FLOAT.unpack_from(data, pos)[0])
+            pos += FLOAT.size
+        else:
+            length, = LENGTH.unpack_from(data, pos)
+            pos += LENGTH.size
+            chunk = data[pos:pos + length]
+            pos += length
+            if tag == STR_TAG:
+                args.append(chunk.decode('utf-8'))
+            elif tag == BYTES_TAG:
+                args.append(chunk)
+            elif tag == PICKLE_TAG:
+                args.append(pickle.loads(chunk))
+            else:
+                raise ValueError(f'Unknown arg tag {tag}')
+    return Instruction(task, tuple(args), to), pos
+
+def pack(instructions: List[Instruction]) -> bytes:
+    """ Encodes instructions as one message, for Connection.send_bytes """
+    out = bytearray(BATCH.pack(len(instructions)))
+    for instruction in instructions:
+        encode(instruction, out)
+    return bytes(out)
+
+def pack_encoded(messages: List[bytes]) -> bytes:
+    """ Frames instructions already run through encode as one pack, each is copied in as is """
+    return BATCH.pack(len(messages)) + b''.join(messages)
+
+def unpack(received: bytes) -> List[Instruction]:
+    """ Returns the instructions in a pack received off a connection, in the order they were sent """
+    count, = BATCH.unpack_from(received, 0)
+    pos = BATCH.size
+    instructions = []
+    for _ in range(count):
+        instruction, pos = decode(received, pos)
+        instructions.append(instruction)
+    return instructions
+
+def benchmark(repeat: int = 20000):
+    """ Prints bytes per message and encode/decode throughput of pack against pickle """
+    messages = {
+        'update': Instruction('update', to = 'display0'),
+        'putEncoded': Instruction('putEncoded', ('rle+zlib', bytes(62)), 'display0'),
+        'moveCharacter': Instruction('moveCharacter', ('Jones', 1, 0), 'game'),
+        'getFromPrompt': Instruction('getFromPrompt', ('Scene Editor: ', 'game'), 'input0'),
+    }
+    for name, instruction in messages.items():
+        results = []
+        for label, dumps, loads in (('pickle', pickle.dumps, pickle.loads), ('pack', lambda item: pack([item]), unpack)):
+            payload = dumps(instruction)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                dumps(instruction)
+            encode_rate = repeat / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                loads(payload)
+            decode_rate = repeat / (time.perf_counter() - start)
+            results.append(f'{label} {len(payload):4} B, encode {encode_rate / 1e3:6.0f}k/s, decode {decode_rate / 1e3:6.0f}k/s')
+        print(f'{name:>14}: ' + ' | '.join(results))
+
+if __name__ == '__main__':
+    benchmark()
\ No newline at end of file
@@ -8,9 +8,10 @@ Base game code for Station Keeper. Powered by DisplayEngine.py
 """
 version_info = 'v0.4'
 
-from Display import Cell, Frame, Sprite, Scene
+from Display import AnimatedSprite, Camera, Cell, ChunkedFrame, ChunkedScene, Compositor, DeltaEncoder, Frame, Sprite, Scene, Timeline, attr, RED, YELLOW
 from DisplayEngine import *
 from InputScreen import get_input, check_input
+from typing import Dict, Tuple, Union
 
 logging.basicConfig()
 log = logging.getLogger(__name__)
@@ -43,7 +44,7 @@ class Character(Sprite):
         self.age = age
         self.pronouns = pronouns
         self.x, self.y = pos
-        super().__init__((1, 1), self.last[0].upper(), (self.x, self.y), first_name)
+        super().__init__((1, 1), self.last[0].upper(), (self.x, self.y), first_name, ' ')
         self.hunger, self.max_hunger, self.hunger_multiplier, self.sleep, self.base_fright = body_stats
         self.str, self.dex, self.int = stats     
         self.inventory = []
@@ -75,6 +76,14 @@ class Character(Sprite):
         if self.hunger > self.max_hunger:
             self.hunger = self.max_hunger
 
+    def status_attr(self) -> int:
+        """ Colour for the character's state, red when starving and yellow when scared """
+        if self.hunger <= self.max_hunger / 4:
+            return attr(RED, bold = True)
+        if self.scared_state:
+            return attr(YELLOW, bold = True)
+        return 0
+
     def sleep_time(self, time: float):
         self.sleep += time
 
@@ -112,8 +121,8 @@ class Food(Item):
         return self.hunger
 
 class Wall(Sprite):
-    def __init__(self, size: Tuple[int, int], chars: str, pos: Tuple[int, int], name = 'Wall'):
-        super().__init__(size, chars, pos, name)
+    def __init__(self, size: Tuple[int, int], chars: str, pos: Tuple[int, int], name = 'Wall', transparent: str = ' '):
+        super().__init__(size, chars, pos, name, transparent)
         self.passable = False
     
     def change_pos(self, new_pos: Tuple[int, int]):
@@ -126,35 +135,97 @@ class Corner(Wall):
     def __init__(self, size: Tuple[int, int], chars: str, pos: Tuple[int, int]):
         super().__init__(size, '#', pos, 'Corner')
 
+# Tasks the engine sends the game on its own, not typed at the prompt
+NOTICES = ('subscribed', )
+
 class SceneEditor(Scene):
 
-    def __init__(self, scene: Scene, to_display: Instance, bg_str: str = ' '):
+    def __init__(self, scene: Union[Scene, ChunkedScene], to_display: Instance, bg_str: str = ' ', shared: bool = False, view_size: Tuple[int, int] = None,
+                 screen: str = 'display0'):
         self.view = False
+        # Where frames go, a display or a topic every watching display subscribed to
+        self.screen = screen
+        self.shared = shared
         self.scene = scene
         self.queue = to_display
         self.sprites: List[Sprite] = []
         for sprite in self.scene.sprites:
             self.sprites.append(sprite)
-        self.characters: List[Character] = []
+        self.characters: Dict[str, Character] = {}
         self.background = bg_str
         self.name = 'scene_editor'
+        self.encoder = DeltaEncoder()
+        # Walls on the bottom, characters above items, UI over everything
+        self.layers = Compositor(self.scene, bg_str)
+        background = self.layers.add_layer('background', 0)
+        if isinstance(self.scene, ChunkedFrame):
+            background.load(self.scene)
+        else:
+            background.writable()[:] = self.scene.glyphs
+        self.layers.add_layer('items', 1)
+        self.layers.add_layer('characters', 2)
+        self.layers.add_layer('ui', 3)
+        # The scene can be bigger than the display, only the camera's window is sent
+        self.camera = Camera(self.scene, view_size or (self.scene.h, self.scene.w), fill_char = bg_str)
+        self.following: str = None
+        self.timeline = Timeline()
+        # Layer each animation is drawn on
+        self.animations: Dict[int, str] = {}
 
     def start(self):
         while True:
             self.queue.instruction_put(Instruction('getFromPrompt', ('Scene Editor: ', 'game', ), 'input0'))
             log.debug('gettingInstructions')
-            instruction = self.queue.parent_queue.get(True)
+            while True:
+                # Animations keep playing while waiting on the prompt
+                try:
+                    instruction = self.queue.parent_queue.get(True, self.timeline.wait_time())
+                except Empty:
+                    self.tick()
+                    continue
+                # Notices from the engine aren't answers to the prompt, it stays up
+                if instruction.get_task() not in NOTICES:
+                    break
+                instruction_handle(instruction)
             assert isinstance(instruction, Instruction), f'{type(instruction)} is not Instruction object'
             instruction_handle(instruction)
 
+    def tick(self):
+        """ Advances every animation and redraws only the ones whose frame changed """
+        changed = self.timeline.advance()
+        for sprite in changed:
+            layer = self.layers.layer(self.animations[id(sprite)])
+            layer.erase((sprite.x, sprite.y), (sprite.h, sprite.w))
+            layer.blit(sprite)
+        if changed:
+            self.show()
+
     def set_view(self, view_state):
         if view_state == 'True':
             self.view = True
         if self.view:
             self.update()
 
-    def update(self, to = 'display0'):
-        self.queue.instruction_put(Instruction('update', to = to))
+    def update(self, to = None):
+        self.queue.instruction_put(Instruction('update', to = to or self.screen))
+
+    def subscribed(self, topic: str, endpoint: str):
+        """ The next frame to topic is a keyframe, so endpoint doesn't wait for one """
+        if topic == self.screen:
+            self.encoder.reset(topic)
+            self.show()
+
+    def show(self, to = None):
+        """ Composites the layers that changed and sends what changed in the camera's view if the scene is being viewed """
+        to = to or self.screen
+        self.layers.composite()
+        if self.view:
+            view = self.camera.render()
+            if self.shared:
+                self.queue.put_shared_frame(view, to)
+            else:
+                self.queue.send_frame(self.encoder.encode(to, view), to)
+            self.update(to)
 
     def make_wall(self, size_x: int, size_y: int, pos_x: int, pos_y: int):
         if size_x > size_y:
@@ -166,50 +237,92 @@ class SceneEditor(Scene):
         pos_x = int(pos_x)
         pos_y = int(pos_y)
         wall = Wall((size_y, size_x), chars, (pos_x, pos_y))
-        self.scene.put_sprite(wall)
+        self.layers.layer('background').blit(wall)
+        self.scene.index.insert(wall)
         self.sprites.append(wall)
         log.debug('Placed wall...')
-        if self.view:
-            self.queue.instruction_put(Instruction('putFrame', (self.scene, ), 'display0'))
-            self.update('display0')
+        self.show()
 
     def make_sprite(self, size_x, size_y, chars, pos_x, pos_y):
         new_sprite = Sprite((size_y, size_x), chars, (pos_x, pos_y))
-        self.scene.put_sprite(new_sprite)
+        self.layers.layer('items').blit(new_sprite)
+        self.scene.index.insert(new_sprite)
         self.sprites.append(new_sprite)
-        if self.view:
-            self.queue.instruction_put(Instruction('putFrame', (self.scene, ), 'display0'))
-            self.update('display0')
+        self.show()
+
+    def add_animation(self, sprite: AnimatedSprite, layer: str = 'items'):
+        self.animations[id(sprite)] = layer
+        self.layers.layer(layer).blit(sprite)
+        self.scene.index.insert(sprite)
+        self.sprites.append(sprite)
+        self.timeline.add(sprite)
+        self.show()
+
+    def make_animation(self, size_x, size_y, frames: str, duration, pos_x, pos_y):
+        """ frames are separated by commas, each shown for duration seconds """
+        try:
+            sprite = AnimatedSprite((int(size_y), int(size_x)), frames.split(','), float(duration), (int(pos_x), int(pos_y)))
+        except ValueError as e:
+            log.debug((e, 'make_animation'))
+            return
+        self.add_animation(sprite)
 
     def get_sprites(self) -> List:
-        return self.sprites + self.characters
+        return self.sprites + list(self.characters.values())
 
     def put_sprite(self, sprite: str):
-        for sprite_num in range(self.sprites):
-            if self.sprites[sprite_num].name == sprite:
-                self.scene.put_sprite(self.sprites[sprite_num])
-        if self.view:
-            self.queue.instruction_put(Instruction('putFrame', (self.scene, ), 'display0'))
-            self.update('display0')
+        for each in self.sprites:
+            if each.name == sprite:
+                self.layers.layer('items').blit(each)
+                self.scene.index.insert(each)
+        self.show()
 
     def add_character(self, character: Character):
-        self.characters.append(character)
-        self.scene.put_sprite(character)
-        if self.view:
-            self.queue.instruction_put(Instruction('putFrame', (self.scene, ), 'display0'))
-            self.update('display0')
+        # Characters are found by first name, a second one would be left on the scene for good
+        if character.first in self.characters:
+            log.error(f'A character named {character.first} is already on the scene')
+            return
+        self.characters[character.first] = character
+        character.attr = character.status_attr()
+        self.layers.layer('characters').blit(character)
+        self.scene.index.insert(character)
+        self.show()
 
     def make_character(self):
         pass
 
     def move_character(self, first_name: str, pos_x: int, pos_y: int):
-        for character in self.characters:
-            if character.first == first_name:
-                self.scene.cells[character.y][character.x].set_value(self.background)
-                self.scene.cells[character.y + pos_y][character.x + pos_x].set_value(character.string)
-        if self.view:
-            self.queue.instruction_put(Instruction('putFrame', (self.scene, ), 'display0'))
-            self.update('display0')       
+        character = self.characters.get(first_name)
+        if character is None:
+            log.debug(f'No character named {first_name}')
+            return
+        new_pos = (character.x + int(pos_x), character.y + int(pos_y))
+        if self.scene.path_blocked(character, new_pos):
+            log.debug(f'{character} can\'t move to {new_pos}')
+            return
+        # Only the characters layer changes, whatever was under the character shows again
+        layer = self.layers.layer('characters')
+        layer.erase((character.x, character.y), (character.h, character.w))
+        self.scene.index.move(character, new_pos)
+        character.attr = character.status_attr()
+        layer.blit(character)
+        if self.following == first_name:
+            self.camera.follow(character)
+        self.show()
+
+    def move_camera(self, pos_x: int, pos_y: int):
+        self.following = None
+        self.camera.pan(int(pos_x), int(pos_y))
+        self.show()
+
+    def follow_character(self, first_name: str):
+        character = self.characters.get(first_name)
+        if character is None:
+            log.debug(f'No character named {first_name}')
+            return
+        self.following = first_name
+        self.camera.follow(character)
+        self.show()
 
 def instruction_loop(queue: Queue):
     while True:
@@ -230,23 +343,31 @@ if __name__ == '__main__':
     size = (50, 180)
     game = Instance('Station Keeper', size, queue, 0.01, 2)
     Jones = Character('Jones', 'A', 54, ('he', 'him', 'his'), (1, 1), (15.0, 20.0, .1, 0.99, 0),(10, 10.0, 6.5))
-    test_scene = Scene(size, [])
-    scene_edit = SceneEditor(test_scene, game)
+    # Mostly empty space, only the chunks something is drawn on are kept
+    test_scene = ChunkedScene((10000, 10000), [])
+    scene_edit = SceneEditor(test_scene, game, view_size = size, screen = 'frames/main')
     scene_edit.add_character(Jones)
-    scene_edit.update('display0')
     
     TASK = {
         'putSprite': scene_edit.put_sprite,
         'makeSprite': scene_edit.make_sprite,
         'makeCharacter': scene_edit.make_character,
         'makeWall': scene_edit.make_wall,
+        'makeAnimation': scene_edit.make_animation,
         'listSprites': scene_edit.get_sprites,
         'moveCharacter': scene_edit.move_character,
         'setView': scene_edit.set_view,
+        'moveCamera': scene_edit.move_camera,
+        'followCharacter': scene_edit.follow_character,
+        'subscribed': scene_edit.subscribed,
     }
 
     #game.hide_logs()
     game.default_start(list(TASK.keys()))
+    # More displays (spectators, a second monitor) only have to subscribe to get the same frames.
+    # The router is running now, so the subscription goes through it
+    game.instruction_put(Instruction('subscribe', ('frames/main', 'display0'), 'displayEngine'))
+    scene_edit.update()
     #get = Process(target = instruction_loop, args = (queue, ))
     #get.start()
 
@@ -0,0 +1,137 @@
+"""
+Terminal v0.4
+
+Author  : Christian Carter
+Date    : 18 Oct 2026
+
+Escape sequence driver for the terminal, shared by Display.py and InputScreen.py.
+Nothing here starts a shell
+"""
+version_info = 'v0.4'
+
+import logging
+import shutil
+import signal
+import sys
+from typing import Tuple
+
+log = logging.getLogger(__name__)
+
+CLEAR = '\x1b[0m\x1b[2J\x1b[H'
+ALTERNATE_ON = '\x1b[?1049h'
+ALTERNATE_OFF = '\x1b[?1049l'
+CURSOR_SHOW = '\x1b[?25h'
+CURSOR_HIDE = '\x1b[?25l'
+
+def cursor_to(row: int, col: int) -> str:
+    """ ANSI escape moving the cursor to row, col (0 based) """
+    return f'\x1b[{row + 1};{col + 1}H'
+
+def title(text: str) -> str:
+    """ OSC escape setting the window title """
+    return f'\x1b]0;{text}\x07'
+
+def resize(size: Tuple[int, int]) -> str:
+    """ xterm window op asking for size (h, w), terminals without it ignore it """
+    return f'\x1b[8;{size[0]};{size[1]}t'
+
+class Terminal:
+    """ Writes escapes to out and remembers the state they left the terminal in,
+        asking for what the terminal already has writes nothing.\n
+        Anything else written to the terminal must call touch, the screen and cursor are unknown after it
+    """
+    def __init__(self, out = None, get_size = None):
+        self.out = out if out is not None else sys.stdout
+        self.get_size = get_size
+        self.title: str = None
+        self.alternate: bool = False
+        self.cursor_visible: bool = True
+        self.cursor: Tuple[int, int] = None
+        self.cleared: bool = False
+        self._size: Tuple[int, int] = None
+        self._watching: bool = False
+        self.skipped: int = 0
+
+    def _watch_resize(self):
+        """ Forgets the size when the window changes, where there is SIGWINCH to say so """
+        self._watching = True
+        if not hasattr(signal, 'SIGWINCH'):
+            self._size = False
+            return
+        try:
+            signal.signal(signal.SIGWINCH, lambda signum, stack: self.forget_size())
+        except ValueError:
+            # Only the main thread can set handlers, the size is asked for every time instead
+            log.debug('Not watching SIGWINCH outside the main thread')
+            self._size = False
+
+    def _emit(self, data: str):
+        self.out.write(data)
+        self.out.flush()
+
+    def _skip(self, what: str):
+        self.skipped += 1
+        log.debug(f'Terminal already {what}')
+
+    def touch(self):
+        """ Marks the screen and cursor unknown after other output """
+        self.cleared = False
+        self.cursor = None
+
+    def clear(self):
+        if self.cleared:
+            return self._skip('clear')
+        self._emit(CLEAR)
+        self.cleared = True
+        self.cursor = (0, 0)
+
+    def move_to(self, row: int, col: int):
+        if self.cursor == (row, col):
+            return self._skip(f'at {row}, {col}')
+        self._emit(cursor_to(row, col))
+        self.cursor = (row, col)
+
+    def set_title(self, text: str):
+        if self.title == text:
+            return self._skip(f'titled {text}')
+        self._emit(title(text))
+        self.title = text
+
+    def alternate_screen(self, on: bool = True):
+        """ Switches to (or back from) the alternate screen, the shell's scrollback is left alone """
+        if self.alternate == on:
+            return self._skip('on the alternate screen' if on else 'on the main screen')
+        self._emit(ALTERNATE_ON if on else ALTERNATE_OFF)
+        self.alternate = on
+        self.touch()
+
+    def show_cursor(self, visible: bool = True):
+        if self.cursor_visible == visible:
+            return self._skip('showing the cursor' if visible else 'hiding the cursor')
+        self._emit(CURSOR_SHOW if visible else CURSOR_HIDE)
+        self.cursor_visible = visible
+
+    def forget_size(self):
+        if self._size is not False:
+            self._size = None
+
+    def size(self) -> Tuple[int, int]:
+        """ Returns the terminal size (h, w), only asked for again after the window changed """
+        if self.get_size is not None:
+            return self.get_size()
+        if not self._watching:
+            self._watch_resize()
+        if self._size:
+            return self._size
+        columns, lines = shutil.get_terminal_size()
+        if self._size is not False:
+            self._size = (lines, columns)
+        return (lines, columns)
+
+    def set_size(self, size: Tuple[int, int]):
+        """ Asks the terminal to be size (h, w) if it isn't already """
+        if self.size() == tuple(size):
+            return self._skip(f'{size[0]}x{size[1]}')
+        self._emit(resize(size))
+        self.forget_size()
+        self.touch()
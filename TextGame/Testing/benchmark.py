@@ -0,0 +1,130 @@
+"""
+Rendering Benchmarks v0.4
+
+Author  : Christian Carter
+Date    : 18 Oct 2026
+
+Times the rendering stack at several screen sizes, writes the results as JSON
+and fails if anything is slower than its threshold
+"""
+version_info = 'v0.4'
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import sys
+import timeit
+from typing import Callable, Dict, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Display import *
+
+log.setLevel(logging.CRITICAL)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS = os.path.join(HERE, 'benchmark_results.json')
+THRESHOLDS = os.path.join(HERE, 'benchmark_thresholds.json')
+SIZES = [(40, 70), (50, 180), (200, 600)]
+
+def station(size: Tuple[int, int]) -> Scene:
+    """ A walled scene like the ones StationKeeper builds """
+    h, w = size
+    return Scene(size, [Sprite((1, w - 2), '=', (1, 1)), Sprite((1, w - 2), '=', (1, h - 2)),
+                        Sprite((h - 4, 1), '|', (1, 2)), Sprite((h - 4, 1), '|', (w - 2, 2)),
+                        Sprite((1, 1), 'J', (3, 3))])
+
+def benchmarks(size: Tuple[int, int]) -> Dict[str, Callable[[], object]]:
+    """ Operation name -> function doing it once at size """
+    h, w = size
+    frame = Frame(size)
+    draw = Draw(frame)
+    target = Frame(size)
+    sprites = [Sprite((3, 10), '= ', (index * 7 % w, index * 3 % h), transparent = ' ') for index in range(100)]
+    scene = station(size)
+    buffer = FrameBuffer(3)
+    backend = HeadlessBackend(size, record = False)
+    renderer = DiffRenderer(backend)
+    moving = station(size)
+    step = [0]
+
+    def put_sprites():
+        for sprite in sprites:
+            target.blit(sprite)
+
+    def to_str():
+        target.touch(0, h)
+        return str(target)
+
+    def buffer_put_get():
+        for _ in range(100):
+            buffer.put(scene)
+            buffer.get()
+
+    def render_move():
+        step[0] = (step[0] + 1) % (w - 8)
+        moving.cells[h // 2][step[0] + 4].set_value('J')
+        moving.cells[h // 2][step[0] + 3].set_value(' ')
+        renderer.render(moving)
+
+    return {
+        'frame_create': lambda: Frame(size),
+        'fill': lambda: draw.fill('#'),
+        'put_100_sprites': put_sprites,
+        'str': to_str,
+        'framebuffer_100_put_get': buffer_put_get,
+        'pickle_scene': lambda: pickle.dumps(scene),
+        'render_move': render_move,
+    }
+
+def run(number: int = 20, repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    """ Returns {size: {operation: best seconds per call}} """
+    results = {}
+    for size in SIZES:
+        key = f'{size[0]}x{size[1]}'
+        results[key] = {}
+        for name, func in benchmarks(size).items():
+            best = min(timeit.repeat(func, number = number, repeat = repeat)) / number
+            results[key][name] = best
+            print(f'{key:>8} {name:<24} {best * 1e6:12.2f} us')
+    return results
+
+def check(results: Dict[str, Dict[str, float]], thresholds: Dict[str, Dict[str, float]]) -> List[str]:
+    """ Returns a message for every result over its threshold """
+    failed = []
+    for size, operations in thresholds.items():
+        for name, limit in operations.items():
+            took = results.get(size, {}).get(name)
+            if took is not None and took > limit:
+                failed.append(f'{size} {name}: {took * 1e6:.2f} us, threshold {limit * 1e6:.2f} us')
+    return failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the TextGame rendering stack')
+    parser.add_argument('--number', type = int, default = 20, help = 'calls per timing')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'timings per operation, the best is kept')
+    parser.add_argument('--output', default = RESULTS, help = 'where to write the results JSON')
+    parser.add_argument('--thresholds', default = THRESHOLDS, help = 'thresholds JSON to check against')
+    parser.add_argument('--save-thresholds', type = float, metavar = 'FACTOR',
+                        help = 'write thresholds of FACTOR times these results instead of checking')
+    args = parser.parse_args()
+
+    results = run(args.number, args.repeat)
+    with open(args.output, 'w') as file:
+        json.dump({'version': version_info, 'python': sys.version.split()[0], 'seconds': results}, file, indent = 2)
+    if args.save_thresholds:
+        thresholds = {size: {name: took * args.save_thresholds for name, took in operations.items()}
+                      for size, operations in results.items()}
+        with open(args.thresholds, 'w') as file:
+            json.dump(thresholds, file, indent = 2)
+        print(f'Thresholds written to {args.thresholds}')
+        sys.exit(0)
+    if not os.path.exists(args.thresholds):
+        print(f'No thresholds at {args.thresholds}, nothing checked')
+        sys.exit(0)
+    with open(args.thresholds) as file:
+        failed = check(results, json.load(file))
+    for message in failed:
+        print(f'SLOWER: {message}')
+    sys.exit(1 if failed else 0)
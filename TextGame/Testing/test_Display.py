@@ -1,22 +1,656 @@
 import unittest
+import pickle
 from Display import *
+import os
+import sys
+from threading import Thread
 from time import sleep
 from os import system
 
+log.setLevel(logging.CRITICAL)
+
 class TestFrame(unittest.TestCase):
 
-    baseFrame = Frame(50, 50, 0)
+    baseFrame = Frame((50, 50))
 
     def test_init(self):
-        self.assertTrue(self.baseFrame.priority == 0)
-        self.assertTrue(self.baseFrame.pos == (0,0))
-
-    def test_intersect(self):
-        new_frame_1 = Frame(10, 10, 1, (0, 0))
-        new_frame_2 = Frame(10, 5, 1, (11, 11))
-        new_frame_3 = Frame(10, 10, 1, (2, 2))
-        self.assertFalse(new_frame_1.intersect(new_frame_2))
-        self.assertTrue(new_frame_2.intersect(new_frame_3))
-        
+        self.assertEqual((self.baseFrame.h, self.baseFrame.w), (50, 50))
+        self.assertEqual(len(self.baseFrame.glyphs), 2500)
+        self.assertEqual(str(self.baseFrame), ' ' * 2500)
+        self.assertIsNone(self.baseFrame.attrs)
+
+    def test_cells(self):
+        frame = Frame((3, 4))
+        frame.cells[1][2].set_value('x')
+        self.assertEqual(frame.cells[1][2].value, 'x')
+        self.assertEqual(str(frame.cells[1]), '  x ')
+        self.assertEqual(len(frame.cells), 3)
+        with self.assertRaises(IndexError):
+            frame.cells[3]
+
+    def test_write_row(self):
+        frame = Frame((2, 5))
+        frame.write_row(1, 1, glyph_array('abc'))
+        self.assertEqual(frame.glyphs.tounicode(), '      abc ')
+        self.assertEqual(frame.read_row(1, 2, 3), (glyph_array('bc '), None))
+        frame.write_row(0, 0, glyph_array('xy'), attr_array(2, attr(RED)))
+        self.assertEqual(frame.read_row(0, 1, 2), (glyph_array('y '), array('H', [attr(RED), 0])))
+
+    def test_copy(self):
+        frame = Frame((2, 3), fill_char = '.')
+        copy = frame.copy()
+        copy.cells[0][0].set_value('x')
+        self.assertEqual(str(frame), '......')
+        self.assertEqual(str(copy), 'x.....')
+        self.assertIsNot(copy.glyphs, frame.glyphs)
+
+    def test_fill(self):
+        frame = Frame((3, 4))
+        draw = Draw(frame)
+        draw.fill('#', attr(RED))
+        draw.stop_drawing()
+        self.assertEqual(str(frame), '#' * 12)
+        self.assertEqual(frame.cells[2][3].attr, attr(RED))
+
+    def test_pickle(self):
+        scene = Scene((3, 4), [Sprite((1, 1), 'J', (1, 1))])
+        self.assertEqual(str(pickle.loads(pickle.dumps(scene))), str(scene))
+
+class TestRowCache(unittest.TestCase):
+
+    def test_str_is_stable(self):
+        frame = Frame((3, 4))
+        self.assertEqual(str(frame), str(frame))
+        self.assertEqual(len(str(frame)), 12)
+
+    def test_only_touched_rows_rebuilt(self):
+        frame = Frame((3, 4))
+        rows = [frame.row_string(row) for row in range(3)]
+        text = str(frame)
+        self.assertIs(str(frame), text)
+        frame.cells[1][2].set_value('x')
+        self.assertIs(frame.row_string(0), rows[0])
+        self.assertIs(frame.row_string(2), rows[2])
+        self.assertEqual(frame.row_string(1), '  x ')
+        self.assertEqual(frame.row_versions, [0, 1, 0])
+        self.assertEqual(str(frame), '      x     ')
+
+class TestBlit(unittest.TestCase):
+
+    def test_clips(self):
+        frame = Frame((3, 4))
+        frame + Sprite((2, 3), 'abcdef', (2, 2))
+        frame + Sprite((2, 2), 'wxyz', (-1, -1))
+        self.assertEqual([frame.row_string(row) for row in range(3)], ['z   ', '    ', '  ab'])
+
+    def test_transparent(self):
+        frame = Frame((1, 5), fill_char = '.')
+        frame + Sprite((1, 5), 'a b c', (0, 0), transparent = ' ')
+        self.assertEqual(str(frame), 'a.b.c')
+
+    def test_transparent_clipped(self):
+        frame = Frame((2, 4), fill_char = '.')
+        frame + Sprite((2, 4), 'a  bc  d', (-2, 1), transparent = ' ')
+        self.assertEqual([frame.row_string(row) for row in range(2)], ['....', '.b..'])
+        frame + Sprite((2, 4), 'a  bc  d', (1, 0), transparent = ' ')
+        self.assertEqual([frame.row_string(row) for row in range(2)], ['.a..', '.c..'])
+
+    def test_off_frame(self):
+        frame = Frame((2, 2))
+        frame + Sprite((1, 1), 'x', (5, 0))
+        frame + Sprite((1, 1), 'x', (0, -1))
+        self.assertEqual(str(frame), '    ')
+        self.assertEqual(frame.row_versions, [0, 0])
+
+class TestSpriteAtlas(unittest.TestCase):
+
+    def test_copy_on_write(self):
+        first = Sprite((1, 3), 'abc', (0, 0))
+        second = Sprite((1, 3), 'abc', (0, 0))
+        self.assertIs(first.glyphs, second.glyphs)
+        second.cells[0][0].set_value('z')
+        self.assertEqual(str(first), 'abc')
+        self.assertEqual(str(second), 'zbc')
+        self.assertIsNone(second.shared)
+
+    def test_shared_runs(self):
+        first = Sprite((1, 3), 'a c', (0, 0), transparent = ' ')
+        second = Sprite((1, 3), 'a c', (4, 0), transparent = ' ')
+        self.assertIs(first.opaque_runs(), second.opaque_runs())
+        self.assertEqual(first.opaque_runs(), [[(0, 1), (2, 3)]])
+
+    def test_entries_dropped(self):
+        atlas = SpriteAtlas()
+        shared = atlas.intern((1, 2), 'ab')
+        self.assertIs(atlas.intern((1, 2), 'ab'), shared)
+        self.assertIsNot(atlas.intern((2, 1), 'ab'), shared)
+        del shared
+        self.assertEqual(len(atlas), 0)
+
+class TestFrameBuffer(unittest.TestCase):
+
+    def test_drop_oldest(self):
+        buffer = FrameBuffer(3)
+        for frame in range(5):
+            buffer.put(frame)
+        self.assertEqual([buffer.get() for _ in range(3)], [2, 3, 4])
+        self.assertEqual(buffer.dropped, 2)
+        self.assertEqual(buffer.get(), 4)
+
+    def test_keep_newest(self):
+        buffer = FrameBuffer(3, KEEP_NEWEST)
+        for frame in range(5):
+            buffer.put(frame)
+        self.assertEqual(buffer.len(), 1)
+        self.assertEqual(buffer.get(), 4)
+
+    def test_block(self):
+        buffer = FrameBuffer(1, BLOCK, timeout = 0.01)
+        buffer.put(0)
+        with self.assertRaises(NoBufferSpace):
+            buffer.put(1)
+
+    def test_front(self):
+        blank = Frame((1, 1))
+        buffer = FrameBuffer(2, front = blank)
+        self.assertIs(buffer.get(), blank)
+        buffer.put(1)
+        buffer.put(2)
+        self.assertEqual(buffer.occupancy(), 1.0)
+        self.assertEqual(buffer.get(), 1)
+        buffer.clear()
+        # Nothing waiting, the last frame shown is shown again
+        self.assertEqual(buffer.get(), 1)
+        self.assertEqual(buffer.stats(), {'waiting': 0, 'size': 2, 'puts': 2, 'gets': 1, 'dropped': 1})
+
+    def test_block_threads(self):
+        buffer = FrameBuffer(2, BLOCK, timeout = 5)
+        got = []
+        def consume():
+            while len(got) < 2000:
+                if buffer.len():
+                    got.append(buffer.get())
+                else:
+                    sleep(0)
+        consumer = Thread(target = consume)
+        consumer.start()
+        for frame in range(2000):
+            buffer.put(frame)
+        consumer.join(5)
+        self.assertEqual(got, list(range(2000)))
+        self.assertEqual((buffer.puts, buffer.gets, buffer.dropped, buffer.len()), (2000, 2000, 0, 0))
+
+class TestFramePacer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.display = Display((2, 4), 'Test', HeadlessBackend((2, 4)))
+        self.pacer = FramePacer(self.display, 4, report_time = 100, clock = lambda: self.now)
+
+    def put(self, char: str):
+        scene = Scene((2, 4), [])
+        scene.cells[0][0].set_value(char)
+        self.display.buffer.put(scene)
+        self.pacer.update()
+
+    def test_one_render_per_tick(self):
+        self.put('a')
+        self.put('b')
+        self.put('c')
+        self.pacer.tick()
+        self.assertEqual(self.display.backend.text()[0], 'c   ')
+        self.assertEqual((self.pacer.rendered, self.pacer.skipped()), (1, 2))
+        self.put('d')
+        self.now = 0.125
+        self.pacer.tick()
+        self.assertEqual(self.pacer.rendered, 1)
+        self.assertEqual(self.pacer.wait_time(), 0.125)
+        self.now = 0.25
+        self.pacer.tick()
+        self.pacer.tick()
+        self.assertEqual(self.pacer.rendered, 2)
+        self.assertEqual(self.display.backend.text()[0], 'd   ')
+
+    def test_slow_render(self):
+        self.pacer.tick()
+        # The next tick was due at 0.25, the ones missed until 1.125 are skipped
+        self.now = 1.125
+        self.put('a')
+        self.pacer.tick()
+        self.assertEqual(self.pacer.next_tick, 1.25)
+        self.put('b')
+        self.pacer.tick()
+        self.assertEqual(self.pacer.rendered, 1)
+        self.now = 1.25
+        self.pacer.tick()
+        self.assertEqual(self.pacer.rendered, 2)
+
+class TestTerminalBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.pipe, write_end = os.pipe()
+        self.out = os.fdopen(write_end, 'w')
+        self.addCleanup(os.close, self.pipe)
+        self.addCleanup(self.out.close)
+        self.scene = Scene((4, 10), [Sprite((2, 9), 'J' * 18, (1, 0))])
+
+    def render(self, synchronized: bool = True) -> bytes:
+        """ Renders the scene through a backend writing to the pipe and returns what one render wrote """
+        # Small enough that the first render has to grow the buffer
+        self.backend = TerminalBackend(self.out, capacity = 16, synchronized = synchronized)
+        display = Display((4, 10), 'Test', self.backend)
+        os.read(self.pipe, 1 << 16)
+        syscalls = self.backend.syscalls
+        display.buffer.put(self.scene)
+        display.update()
+        self.assertEqual(self.backend.syscalls, syscalls + 1)
+        return os.read(self.pipe, 1 << 16)
+
+    def test_synchronized(self):
+        data = self.render()
+        self.assertTrue(data.startswith(SYNC_START))
+        self.assertTrue(data.endswith(SYNC_END))
+        self.assertEqual(data.count(b' ' + b'J' * 9), 2)
+        self.assertGreater(len(self.backend.buffer), 16)
+        self.assertEqual(self.backend.length, self.backend.start)
+
+    def test_unsynchronized(self):
+        data = self.render(False)
+        self.assertNotIn(SYNC_START, data)
+        self.assertNotIn(SYNC_END, data)
+        self.assertEqual(data.count(b' ' + b'J' * 9), 2)
+
+class TestRender(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = HeadlessBackend((4, 10))
+        self.display = Display((4, 10), 'Test', self.backend)
+        self.scene = Scene((4, 10), [])
+
+    def show(self):
+        self.display.buffer.put(self.scene)
+        self.display.update()
+
+    def test_diff(self):
+        self.show()
+        self.scene.cells[1][1].set_value('J')
+        self.show()
+        self.assertEqual(self.backend.written[-1], '\x1b[2;2HJ\x1b[5;1H')
+        self.assertEqual(self.backend.text()[1], ' J        ')
+        self.show()
+        self.assertEqual(self.backend.written[-1], '\x1b[2;2HJ\x1b[5;1H')
+
+    def test_invalidate(self):
+        self.show()
+        self.display.renderer.invalidate()
+        self.show()
+        self.assertTrue(self.backend.written[-1].startswith('\x1b[2J'))
+        self.assertEqual(self.backend.written[-1].count(' ' * 10), 4)
+        self.show()
+        self.assertEqual(self.display.renderer.render(self.scene), 0)
+
+    def test_changed_runs(self):
+        self.assertEqual(changed_runs('abcdefghij', 'abXdefghiY'), [(2, 3), (9, 10)])
+        self.assertEqual(changed_runs('abcdefghij', 'abXdeXghij'), [(2, 6)])
+        self.assertEqual(changed_runs('abc', 'abc', old_attrs = attr_array(3), new_attrs = array('H', [0, 1, 0])), [(1, 2)])
+
+    def test_clear_after_render(self):
+        self.display.clear()
+        skipped = self.backend.terminal.skipped
+        self.scene.cells[0][0].set_value('J')
+        self.show()
+        self.display.clear()
+        self.assertEqual(self.backend.text()[0], ' ' * 10)
+        self.assertEqual(self.backend.terminal.skipped, skipped)
+        self.display.clear()
+        self.assertEqual(self.backend.terminal.skipped, skipped + 1)
+
+class TestHeadlessBackend(unittest.TestCase):
+
+    def test_screen(self):
+        backend = HeadlessBackend((3, 4))
+        backend.write('ab\ncd\x1b[3;3Hefgh')
+        self.assertEqual(backend.text(), ['ab  ', 'cd  ', '  ef'])
+        backend.write('\x1b[1;2H\x1b[0;1;32mX\x1b[0mY')
+        self.assertEqual(backend.text()[0], 'aXY ')
+        self.assertEqual(backend.screen_attrs[0][1:3], [attr(GREEN, bold = True), 0])
+        backend.write('\x1b]0;Game\x07\x1b[2J')
+        self.assertEqual(backend.title, 'Game')
+        self.assertEqual(backend.text(), ['    '] * 3)
+        self.assertEqual(len(backend.written), 3)
+
+    def test_unrecorded(self):
+        backend = HeadlessBackend((2, 2), record = False)
+        display = Display((2, 2), 'Test', backend)
+        written = backend.bytes_written
+        display.buffer.put(Scene((2, 2), [Sprite((1, 1), 'é', (0, 0))]))
+        display.update()
+        self.assertEqual(backend.written, [])
+        self.assertEqual(backend.text(), ['é ', '  '])
+        # Bytes, not characters
+        self.assertEqual(backend.bytes_written - written, display.renderer.bytes_written + 1)
+        display.resize((3, 1))
+        self.assertEqual((backend.h, backend.w), (3, 1))
+
+class TestColour(unittest.TestCase):
+
+    def test_attr(self):
+        self.assertEqual(attr(), 0)
+        self.assertEqual(attr(BLACK), 1)
+        self.assertEqual(attr(RED, BLUE, True), BOLD | (BLUE + 1) << 4 | RED + 1)
+        self.assertEqual(sgr(attr(RED, BLUE, True)), '\x1b[0;1;31;44m')
+        self.assertEqual(sgr(0), '\x1b[0m')
+
+    def test_plane_made_on_demand(self):
+        frame = Frame((2, 3))
+        frame + Sprite((1, 3), 'abc', (0, 0))
+        self.assertFalse(frame.colour)
+        self.assertIsNone(frame.row_attrs(0))
+        frame.cells[1][1].set_attr(attr(GREEN))
+        self.assertTrue(frame.colour)
+        self.assertEqual(list(frame.row_attrs(1)), [0, attr(GREEN), 0])
+        # Plain sprites put over colour reset the cells they cover
+        frame + Sprite((1, 3), 'xyz', (0, 1))
+        self.assertEqual(list(frame.row_attrs(1)), [0, 0, 0])
+
+    def test_render(self):
+        backend = HeadlessBackend((4, 10))
+        display = Display((4, 10), 'Test', backend)
+        scene = Scene((4, 10), [Sprite((1, 2), 'ab', (3, 2), attr = attr(GREEN, bold = True))])
+        display.buffer.put(scene)
+        display.update()
+        self.assertEqual(backend.text()[2], '   ab     ')
+        self.assertEqual(backend.screen_attrs[2][4], attr(GREEN, bold = True))
+        self.assertEqual(backend.screen_attrs[2][5], 0)
+        self.assertEqual(backend.written[-1].count(sgr(attr(GREEN, bold = True))), 1)
+
+class TestCompositor(unittest.TestCase):
+
+    def test_reveals_lower_layers(self):
+        scene = Scene((3, 6), [])
+        layers = Compositor(scene)
+        walls = layers.add_layer('walls', 0)
+        people = layers.add_layer('people', 1)
+        walls.blit(Sprite((1, 6), '=', (0, 1)))
+        person = Sprite((1, 1), 'J', (2, 1))
+        people.blit(person)
+        layers.composite()
+        self.assertEqual(scene.row_string(1), '==J===')
+        people.erase((2, 1), (1, 1))
+        layers.composite()
+        self.assertEqual(scene.row_string(1), '======')
+
+    def test_dirty_spans(self):
+        scene = Scene((3, 6), [])
+        layers = Compositor(scene, '.')
+        walls = layers.add_layer('walls', 0)
+        self.assertEqual(layers.composite(), 3)
+        self.assertEqual(layers.composite(), 0)
+        versions = list(scene.row_versions)
+        walls.blit(Sprite((1, 2), '#', (1, 2)))
+        self.assertEqual(walls.dirty, {2: [1, 3]})
+        self.assertEqual(layers.composite(), 1)
+        self.assertEqual(scene.row_versions, [versions[0], versions[1], versions[2] + 1])
+        self.assertEqual(scene.row_string(2), '.##...')
+
+    def test_attributes(self):
+        scene = Scene((1, 4), [])
+        layers = Compositor(scene)
+        layers.add_layer('floor', 0).blit(Sprite((1, 4), '_', (0, 0), attr = attr(BLUE)))
+        layers.add_layer('people', 1).blit(Sprite((1, 1), 'J', (1, 0), attr = attr(RED)))
+        layers.composite()
+        self.assertEqual(scene.row_string(0), '_J__')
+        self.assertEqual(list(scene.row_attrs(0)), [attr(BLUE), attr(RED), attr(BLUE), attr(BLUE)])
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def test_query(self):
+        index = SpatialIndex(4)
+        wall = Sprite((1, 20), '=', (0, 5))
+        person = Sprite((1, 1), 'J', (3, 3))
+        index.insert(wall)
+        index.insert(person)
+        self.assertEqual(index.at(15, 5), [wall])
+        self.assertEqual(index.at(15, 6), [])
+        self.assertEqual(index.query((2, 2), (5, 5)), [person, wall])
+        index.move(person, (30, 30))
+        self.assertEqual(index.at(3, 3), [])
+        self.assertEqual(index.at(30, 30), [person])
+
+    def test_scene_blocked(self):
+        wall = Sprite((3, 1), '#', (4, 0))
+        wall.passable = False
+        person = Sprite((1, 1), 'J', (1, 1))
+        scene = Scene((3, 8), [wall, person, Sprite((1, 1), '.', (2, 1))])
+        self.assertFalse(scene.blocked(person, (2, 1)))
+        self.assertTrue(scene.blocked(person, (4, 1)))
+        self.assertTrue(scene.blocked(person, (-1, 1)))
+        self.assertFalse(scene.blocked(person, (6, 1)))
+        self.assertTrue(scene.path_blocked(person, (6, 1)))
+        self.assertFalse(scene.path_blocked(person, (3, 2)))
+
+class TestCamera(unittest.TestCase):
+
+    def test_render(self):
+        world = Scene((40, 100), [])
+        for row in range(40):
+            world + Sprite((1, 1), chr(65 + row % 26), (row, row))
+        camera = Camera(world, (5, 10))
+        self.assertEqual(camera.render().row_string(1), ' B' + ' ' * 8)
+        self.assertEqual(camera.rows_copied, 5)
+        # Panning down reuses the rows that are still visible
+        camera.pan(0, 2)
+        self.assertEqual(camera.render().row_string(0), '  C' + ' ' * 7)
+        self.assertEqual(camera.rows_copied, 7)
+        world.cells[6][3].set_value('x')
+        self.assertEqual(camera.render().row_string(4), '   x  G   ')
+        self.assertEqual(camera.rows_copied, 8)
+        camera.move_to((500, 500))
+        self.assertEqual((camera.x, camera.y), (90, 35))
+
+class TestChunkedScene(unittest.TestCase):
+
+    def test_sparse(self):
+        world = ChunkedScene((10000, 10000), [])
+        self.assertEqual(len(world.chunks), 0)
+        # Lands on the corner of four chunks
+        world.put_sprite(Sprite((2, 4), 'ABCDEFGH', (62, 63), attr = attr(RED)))
+        self.assertEqual(len(world.chunks), 4)
+        self.assertEqual(world.row_string(63)[60:68], '  ABCD  ')
+        glyphs, attrs = world.read_row(64, 62, 6)
+        self.assertEqual(glyphs.tounicode(), 'EFGH  ')
+        self.assertEqual(list(attrs), [attr(RED)] * 4 + [0] * 2)
+        self.assertEqual(world.clean_chunks(), {(0, 0), (0, 1), (1, 0), (1, 1)})
+        self.assertTrue(world.blocked(Sprite((1, 1), 'J', (0, 0)), (10000, 5)))
+
+    def test_compositor(self):
+        world = ChunkedScene((10000, 10000), [])
+        layers = Compositor(world)
+        layers.add_layer('background', 0)
+        characters = layers.add_layer('characters', 1)
+        characters.blit(Sprite((1, 1), 'J', (5000, 5000)))
+        layers.composite()
+        self.assertEqual(len(world.chunks), 1)
+        self.assertEqual(world.row_string(5000)[4999:5002], ' J ')
+        characters.erase((5000, 5000), (1, 1))
+        layers.composite()
+        camera = Camera(world, (5, 10), (4995, 4998))
+        self.assertEqual(camera.render().row_string(2), ' ' * 10)
+
+    def test_layers_track_alike(self):
+        for target in (Scene((4, 100), []), ChunkedScene((4, 100), [], chunk_size = 8)):
+            layer = Compositor(target).add_layer('people', 1)
+            layer.dirty = {}
+            layer + Sprite((2, 3), 'J', (6, 1))
+            layer.erase((5, 2), (3, 4))
+            self.assertEqual(layer.dirty, {1: [6, 9], 2: [5, 9], 3: [5, 9]}, repr(target))
+            self.assertEqual(layer.row_string(2)[4:10], '\0\0\0\0\0\0')
+
+class TestTimeline(unittest.TestCase):
+
+    def test_advance(self):
+        timeline = Timeline(clock = lambda: 0)
+        spinner = AnimatedSprite((1, 1), ['/', '-', '\\'], [0.5, 0.25, 0.25], (0, 0))
+        alarm = AnimatedSprite((1, 1), ['!', ' '], 1.0, (2, 0), frame_attrs = [attr(RED, bold = True), 0], loop = False)
+        timeline.add(spinner)
+        timeline.add(alarm)
+        self.assertIs(spinner.glyphs, atlas.intern((1, 1), '/').glyphs)
+        self.assertEqual(timeline.advance(0.4), [])
+        self.assertEqual(timeline.advance(0.5), [spinner])
+        self.assertEqual(str(spinner), '-')
+        # A late tick skips ahead to the frame that should be showing
+        self.assertEqual(timeline.advance(1.1), [spinner, alarm])
+        self.assertEqual((str(spinner), str(alarm), alarm.attr), ('/', ' ', 0))
+        timeline.advance(5.0)
+        self.assertEqual(len(timeline), 1)
+        self.assertAlmostEqual(timeline.wait_time(5.0), 0.5)
+
+    def test_zero_duration(self):
+        with self.assertRaises(ValueError):
+            AnimatedSprite((1, 1), ['a', 'b'], 0, (0, 0))
+        with self.assertRaises(ValueError):
+            AnimatedSprite((1, 1), ['a', 'b'], [0.5, -1], (0, 0))
+
+class TestFrameDelta(unittest.TestCase):
+
+    def test_round_trip(self):
+        scene = Scene((5, 20), [Sprite((1, 18), '=', (1, 1))])
+        encoder = DeltaEncoder()
+        frame = encoder.encode('display0', scene).apply()
+        scene.cells[3][3].set_value('J')
+        delta = encoder.encode('display0', scene)
+        self.assertFalse(delta.keyframe)
+        self.assertEqual(len(delta.runs), 1)
+        self.assertEqual(str(delta.apply(frame)), str(scene))
+
+    def test_reset_all(self):
+        encoder = DeltaEncoder()
+        scene = Scene((2, 4), [Sprite((1, 1), 'J', (0, 0), attr = attr(RED))])
+        encoder.encode('display0', scene)
+        encoder.encode('display1', scene)
+        encoder.reset()
+        self.assertEqual((encoder.sent, encoder.sent_attrs), ({}, {}))
+        self.assertTrue(encoder.encode('display1', scene).keyframe)
+
+    def test_display_drops_gaps(self):
+        display = Display((2, 4), 'Test', HeadlessBackend((2, 4)))
+        scene = Scene((2, 4), [])
+        encoder = DeltaEncoder()
+        display.put_delta(encoder.encode('display0', scene))
+        scene.cells[0][0].set_value('a')
+        encoder.encode('display0', scene)
+        scene.cells[1][1].set_value('b')
+        # The delta before it never arrived, this one can't be applied
+        display.put_delta(encoder.encode('display0', scene))
+        self.assertEqual(display.received_seq, 1)
+        self.assertEqual(str(display.received), ' ' * 8)
+        encoder.reset('display0')
+        keyframe = encoder.encode('display0', scene)
+        self.assertTrue(keyframe.keyframe)
+        display.put_delta(keyframe)
+        self.assertEqual(display.received_seq, 4)
+        self.assertEqual(str(display.received), 'a    b  ')
+        self.assertEqual(display.buffer.len(), 2)
+
+def attach(name: str) -> SharedFrameBuffer:
+    """ Attaches a reader in this process.\n
+        Before 3.13 the reader unregisters the segment from this process' resource tracker,
+        which would make the tracker raise KeyError when the owner unlinks it. It is registered
+        again here, in a real display the reader is in another process
+    """
+    reader = SharedFrameBuffer(name = name)
+    keep_tracked(reader)
+    return reader
+
+def keep_tracked(reader: SharedFrameBuffer):
+    if sys.version_info < (3, 13) and os.name == 'posix':
+        resource_tracker.register(reader.shm._name, 'shared_memory')
+
+class TestSharedFrameBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.scene = Scene((4, 6), [Sprite((1, 4), '=', (1, 1))])
+        self.writer = SharedFrameBuffer((4, 6))
+        self.reader = attach(self.writer.name)
+        self.addCleanup(self.writer.close)
+        self.addCleanup(self.reader.close)
+
+    def rows(self, frame: Frame) -> List[str]:
+        return [frame.row_string(row) for row in range(frame.h)]
+
+    def test_full_read(self):
+        self.assertEqual(self.writer.write(self.scene), 2)
+        frame = self.reader.read()
+        self.assertEqual(self.rows(frame), self.rows(self.scene))
+        self.assertIsNone(frame.attrs)
+        self.assertEqual(self.reader.seq, 2)
+
+    def test_dirty_rows(self):
+        self.writer.write(self.scene)
+        frame = self.reader.read()
+        self.scene.cells[3][0].set_value('J')
+        self.writer.write(self.scene)
+        # Rows the last write didn't change come from the frame passed in, not shared memory
+        frame.cells[0][0].set_value('x')
+        frame = self.reader.read(frame)
+        self.assertEqual(self.rows(frame), ['x     ', ' ==== ', '      ', 'J     '])
+
+    def test_missed_write(self):
+        self.writer.write(self.scene)
+        frame = self.reader.read()
+        self.scene.cells[0][0].set_value('a')
+        self.writer.write(self.scene)
+        self.scene.cells[3][5].set_value('b')
+        self.writer.write(self.scene)
+        # seq jumped by 4, the bitmap only has row 3 so everything is read
+        frame = self.reader.read(frame)
+        self.assertEqual(self.rows(frame), self.rows(self.scene))
+        self.assertEqual(self.reader.seq, 6)
+
+    def test_torn_write(self):
+        self.writer.write(self.scene)
+        buf = self.writer.shm.buf
+        seq, h, w, colour = SharedFrameBuffer.HEADER.unpack_from(buf, 0)
+        SharedFrameBuffer.HEADER.pack_into(buf, 0, seq + 1, h, w, colour)
+        self.assertIsNone(self.reader.read())
+        SharedFrameBuffer.HEADER.pack_into(buf, 0, seq, h, w, colour)
+        self.assertIsNotNone(self.reader.read())
+
+    def test_colour(self):
+        self.writer.write(self.scene)
+        frame = self.reader.read()
+        self.scene + Sprite((1, 2), 'ab', (0, 2), attr = attr(RED, bold = True))
+        self.writer.write(self.scene)
+        frame = self.reader.read(frame)
+        self.assertEqual(self.rows(frame)[2], 'ab    ')
+        self.assertEqual(list(frame.row_attrs(2)), [attr(RED, bold = True)] * 2 + [0] * 4)
+        self.assertEqual(list(frame.row_attrs(1)), [0] * 6)
+
+    def test_display(self):
+        display = Display((4, 6), 'Test', HeadlessBackend((4, 6)))
+        display.attach_shared(self.writer.name)
+        keep_tracked(display.shared)
+        self.addCleanup(display.shared.close)
+        display.frame_ready(self.writer.write(self.scene))
+        display.update()
+        self.assertEqual(display.backend.text(), self.rows(self.scene))
+        self.scene.cells[2][2].set_value('J')
+        display.frame_ready(self.writer.write(self.scene))
+        display.update()
+        self.assertEqual(display.backend.text()[2], '  J   ')
+
+    def test_display_after_delta(self):
+        display = Display((4, 6), 'Test', HeadlessBackend((4, 6)))
+        encoder = DeltaEncoder()
+        display.put_delta(encoder.encode('display0', Scene((4, 6), [])))
+        display.attach_shared(self.writer.name)
+        keep_tracked(display.shared)
+        self.addCleanup(display.shared.close)
+        display.frame_ready(self.writer.write(self.scene))
+        # A delta against the frame before the shared one must not be applied on top of it
+        display.put_delta(encoder.encode('display0', Scene((4, 6), [Sprite((1, 1), 'J', (0, 0))])))
+        self.assertEqual(str(display.received), str(self.scene))
+        self.assertEqual(display.received_seq, -1)
+
 if __name__ == '__main__':
     unittest.main()
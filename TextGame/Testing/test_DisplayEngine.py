@@ -0,0 +1,172 @@
+import unittest
+import queue
+from multiprocessing import Pipe
+from threading import Thread
+from DisplayEngine import *
+from Display import DeltaEncoder, Scene, Sprite
+
+log.setLevel(logging.CRITICAL)
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.game = queue.Queue()
+        self.instance = Instance('test', (5, 5), self.game, 0.1, 2)
+        self.input, input_end = Pipe()
+        self.display, display_end = Pipe()
+        self.instance.inputs.append(input_end)
+        self.instance.displays.append(display_end)
+        # Put before the router runs, kept until it does
+        self.instance.instruction_put(Instruction('early', to = 'game'))
+        self.router = Thread(target = self.instance.start, daemon = True)
+        self.router.start()
+
+    def tearDown(self):
+        self.instance.stop()
+        self.router.join(1)
+        self.assertFalse(self.router.is_alive())
+
+    def test_route(self):
+        self.assertEqual(self.game.get(timeout = 1).get_task(), 'early')
+        self.input.send_bytes(pack([Instruction('move', (1, 0), 'game')]))
+        self.assertEqual(self.game.get(timeout = 1).get(), ('move', (1, 0)))
+        self.instance.instruction_put(Instruction('update', to = 'display0'))
+        self.assertTrue(self.display.poll(1))
+        self.assertEqual(unpack(self.display.recv_bytes())[0].get_task(), 'update')
+        self.instance.instruction_put(Instruction('getFromPrompt', ('Input: ', 'game'), 'input0'))
+        self.assertTrue(self.input.poll(1))
+        self.assertEqual(unpack(self.input.recv_bytes())[0].get_task(), 'getFromPrompt')
+
+class TestStop(unittest.TestCase):
+
+    def test_stop_before_start(self):
+        instance = Instance('test', (5, 5), queue.Queue(), 0.1, 1)
+        instance.stop()
+        router = Thread(target = instance.start, daemon = True)
+        router.start()
+        router.join(1)
+        self.assertFalse(router.is_alive())
+        self.assertIsNone(instance.loop)
+
+class TestRoutes(unittest.TestCase):
+
+    def test_resolve(self):
+        game = queue.Queue()
+        instance = Instance('test', (5, 5), game, 0.1, 12)
+        pipes = [Pipe() for _ in range(12)]
+        instance.displays.extend(end for _, end in pipes)
+        spectators = queue.Queue()
+        self.assertEqual(instance.add_game(spectators), 'game1')
+        instance.add_group('monitors', ['display10', 'display11', 'display*'])
+        instance.add_group('everyone', ['monitors', 'game*'])
+        instance.instruction_handle(Instruction('update', to = 'display10'))
+        self.assertTrue(pipes[10][0].poll())
+        self.assertFalse(pipes[0][0].poll())
+        self.assertEqual(len(instance.routes['display10']), 1)
+        instance.instruction_handle(Instruction('status', to = 'everyone'))
+        self.assertEqual(len(instance.routes['everyone']), 14)
+        self.assertEqual(game.get_nowait().get_task(), 'status')
+        self.assertEqual(spectators.get_nowait().get_task(), 'status')
+        self.assertEqual(instance.routes.get('display12'), None)
+        instance.instruction_handle(Instruction('update', to = 'display12'))
+        self.assertEqual(instance.routes['display12'], [])
+
+class TestTopics(unittest.TestCase):
+
+    def test_publish(self):
+        game = queue.Queue()
+        instance = Instance('test', (5, 5), game, 0.1, 3)
+        pipes = [Pipe() for _ in range(3)]
+        instance.displays.extend(end for _, end in pipes)
+        instance.subscribe('frames/main', 'display0')
+        instance.subscribe('frames/main', 'game')
+        router = Thread(target = instance.start, daemon = True)
+        router.start()
+        # A display subscribes itself, the game hears about it
+        pipes[2][0].send_bytes(pack([Instruction('subscribe', ('frames/main', ), 'displayEngine')]))
+        self.assertEqual(game.get(timeout = 1).get(), ('subscribed', ('frames/main', 'display2')))
+        instance.publish('frames/main', 'putEncoded', ('rle', b'frame'))
+        received = [pipes[num][0].recv_bytes() for num in (0, 2)]
+        self.assertEqual(received[0], received[1])
+        self.assertEqual(unpack(received[0])[0].get(), ('putEncoded', ('rle', b'frame')))
+        self.assertEqual(game.get(timeout = 1).get_task(), 'putEncoded')
+        self.assertFalse(pipes[1][0].poll())
+        instance.stop()
+        router.join(1)
+        self.assertEqual(instance.published, 1)
+
+    def test_bad_instruction(self):
+        game = queue.Queue()
+        instance = Instance('test', (5, 5), game, 0.1, 1)
+        display, display_end = Pipe()
+        instance.displays.append(display_end)
+        router = Thread(target = instance.start, daemon = True)
+        router.start()
+        display.send_bytes(pack([Instruction('subscribe', None, 'displayEngine'),
+                                 Instruction('subscribe', ('display0', 'display0'), 'displayEngine'),
+                                 Instruction('first', to = 'game')]))
+        display.send_bytes(b'not a pack')
+        display.send_bytes(pack([Instruction('second', to = 'game')]))
+        self.assertEqual(game.get(timeout = 1).get_task(), 'first')
+        self.assertEqual(game.get(timeout = 1).get_task(), 'second')
+        instance.stop()
+        router.join(1)
+
+    def test_batch_bytes(self):
+        instance = Instance('test', (5, 5), queue.Queue(), 0.1, 1, batch_bytes = 1 << 10)
+        instance.loop = asyncio.new_event_loop()
+        self.addCleanup(instance.loop.close)
+        display, display_end = Pipe()
+        instance.send(display_end, Instruction('update', to = 'display0'))
+        self.assertFalse(display.poll())
+        frame = Scene((20, 80), [])
+        instance.send(display_end, Instruction('update', (frame, ), 'display0'))
+        self.assertTrue(display.poll())
+        self.assertEqual(len(unpack(display.recv_bytes())), 2)
+        self.assertEqual(instance.outbox_bytes, {})
+
+    def test_fan_out_bytes(self):
+        instance = Instance('test', (5, 5), queue.Queue(), 0.1, 1, batch_bytes = 1 << 10)
+        instance.loop = asyncio.new_event_loop()
+        self.addCleanup(instance.loop.close)
+        display, display_end = Pipe()
+        # Pickled args count towards batch_bytes like any other
+        keyframe = DeltaEncoder().encode('display0', Scene((20, 80), []))
+        instance.fan_out([display_end], [], Instruction('putDelta', (keyframe, ), 'frames/main'))
+        self.assertTrue(display.poll())
+        self.assertEqual(unpack(display.recv_bytes())[0].get_task(), 'putDelta')
+
+class TestSharedFrames(unittest.TestCase):
+
+    def test_share_frames(self):
+        instance = Instance('test', (3, 4), queue.Queue(), 0.1, 1)
+        self.addCleanup(instance.close_shared)
+        shared = instance.share_frames('display0')
+        self.assertIs(instance.share_frames('display0'), shared)
+        scene = Scene((3, 4), [Sprite((1, 2), 'ab', (1, 1))])
+        instance.put_shared_frame(scene, 'display0')
+        # The router isn't running so both instructions are still pending
+        attach, ready = instance.pending
+        self.assertEqual(attach.get(), ('attachShared', (shared.name, )))
+        self.assertEqual(ready.get(), ('frameReady', (2, )))
+        self.assertEqual(ready.destination(), 'display0')
+
+class TestBatching(unittest.TestCase):
+
+    def test_batch(self):
+        instance = Instance('test', (5, 5), queue.Queue(), 0.1, 1, batch_count = 3, batch_delay = 0.05)
+        display, display_end = Pipe()
+        instance.displays.append(display_end)
+        router = Thread(target = instance.start, daemon = True)
+        router.start()
+        for task in ['putEncoded', 'update', 'putEncoded', 'update']:
+            instance.instruction_put(Instruction(task, to = 'display0'))
+        # The first three fill a batch, the last waits out batch_delay on its own
+        self.assertEqual([instruction.get_task() for instruction in unpack(display.recv_bytes())], ['putEncoded', 'update', 'putEncoded'])
+        self.assertEqual(unpack(display.recv_bytes())[0].get_task(), 'update')
+        instance.stop()
+        router.join(1)
+        self.assertEqual((instance.batches_sent, instance.instructions_sent), (2, 4))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from Display import *
+from FrameCodec import *
+
+class TestCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.scene = Scene((20, 60), [Sprite((1, 58), '=', (1, 1)), Sprite((15, 1), '|', (2, 3)),
+                                      Sprite((2, 5), 'ab\0 c', (10, 10))])
+        self.coloured = Scene((20, 60), [Sprite((3, 10), '#', (4, 4), attr = attr(RED, BLUE, True))])
+
+    def test_rle(self):
+        for text in ['', ' ', 'abc', ' ' * 60, 'aaab', '\0', 'x\0\0\0\0\0y', '=' * 4 + '|' * 3]:
+            self.assertEqual(rle_decode(rle_encode(text)), text)
+        self.assertLess(len(rle_encode(' ' * 60)), 4)
+
+    def test_frame_round_trip(self):
+        for codec in CODECS.values():
+            frame = codec.decode(codec.encode(self.scene))
+            self.assertEqual((frame.h, frame.w), (20, 60))
+            self.assertEqual(str(frame), str(self.scene))
+
+    def test_attrs_round_trip(self):
+        for codec in CODECS.values():
+            frame = codec.decode(codec.encode(self.coloured))
+            self.assertEqual(frame.attrs, self.coloured.attrs)
+            self.assertEqual(str(frame), str(self.coloured))
+        self.assertIsNone(Codec().decode(Codec().encode(self.scene)).attrs)
+
+    def test_delta_round_trip(self):
+        encoder = DeltaEncoder()
+        keyframe = encoder.encode('display0', self.scene)
+        self.scene.cells[5][5].set_value('J')
+        self.scene.cells[6][5].set_attr(attr(GREEN))
+        delta = encoder.encode('display0', self.scene)
+        for codec in CODECS.values():
+            for item in (keyframe, delta):
+                decoded = codec.decode(codec.encode(item))
+                self.assertEqual((decoded.seq, decoded.base, decoded.keyframe), (item.seq, item.base, item.keyframe))
+                self.assertEqual(decoded.runs, item.runs)
+            frame = codec.decode(codec.encode(delta)).apply(keyframe.apply())
+            self.assertEqual(str(frame), str(self.scene))
+            self.assertEqual(frame.attrs, self.scene.attrs)
+
+    def test_display_frame_then_delta(self):
+        display = Display((20, 60), 'Test', HeadlessBackend((20, 60)))
+        encoder = DeltaEncoder()
+        codec = CODECS['rle']
+        display.put_encoded('rle', codec.encode(encoder.encode('display0', self.scene)))
+        display.put_encoded('rle', codec.encode(self.coloured))
+        # Based on the keyframe, not on the full frame that replaced it
+        self.scene.cells[0][0].set_value('J')
+        display.put_encoded('rle', codec.encode(encoder.encode('display0', self.scene)))
+        self.assertEqual(str(display.received), str(self.coloured))
+        self.assertEqual(display.received_seq, -1)
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate(['lz4', 'rle']), 'rle')
+        self.assertIsNone(negotiate(['lz4']))
+        self.assertEqual(negotiate(codec_names()), codec_names()[0])
+
+    def test_bad_payload(self):
+        with self.assertRaises(CodecError):
+            Codec().decode(b'X')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import pickle
+from Instruction import *
+
+class TestWireFormat(unittest.TestCase):
+
+    def assertSame(self, got: Instruction, sent: Instruction):
+        self.assertEqual((got.task, got.args, got.to), (sent.task, sent.args, sent.to))
+
+    def test_round_trip(self):
+        sent = [Instruction('update', to = 'display0'),
+                Instruction('putEncoded', ('rle', b'\x00\x01frame'), 'display1'),
+                Instruction('moveCharacter', ('Jones', -1, 0, 2.5, True, None), 'game'),
+                # Not in the registry, the names go inline
+                Instruction('spin', ('☃', ), 'display12'),
+                # Pickled, there is no tag for them
+                Instruction('putFrame', ([1, 2], {'a': (3, 4)}, 1 << 70), 'display0'),
+                Instruction('noArgs', ())]
+        got = unpack(pack(sent))
+        self.assertEqual(len(got), len(sent))
+        for instruction, original in zip(got, sent):
+            self.assertSame(instruction, original)
+
+    def test_size(self):
+        update = Instruction('update', to = 'display0')
+        self.assertEqual(len(pack([update])), 5)
+        self.assertLess(len(pack([update])), len(pickle.dumps(update)))
+        with self.assertRaises(AttributeError):
+            update.extra = 1
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import queue
+import StationKeeper
+from StationKeeper import *
+
+logging.disable(logging.CRITICAL)
+
+class TestSceneEditor(unittest.TestCase):
+
+    def setUp(self):
+        # Not viewed, nothing is sent so no engine is needed
+        self.editor = SceneEditor(Scene((10, 20), []), None)
+
+    def test_make_animation(self):
+        self.editor.make_animation(1, 1, 'a,b', 0.5, 5, 5)
+        self.assertEqual(len(self.editor.timeline), 1)
+        self.assertEqual(self.editor.scene.row_string(5)[5], 'a')
+        # Typed at the prompt, a bad duration is turned away instead of hanging the timeline
+        self.editor.make_animation(1, 1, 'a,b', 0, 6, 6)
+        self.editor.make_animation(1, 1, 'a,b', 'soon', 6, 6)
+        self.assertEqual(len(self.editor.timeline), 1)
+
+    def test_walls_block(self):
+        jones = Character('Jones', 'A', 54, ('he', 'him', 'his'), (1, 1), (15.0, 20.0, .1, 0.99, 0), (10, 10.0, 6.5))
+        self.editor.add_character(jones)
+        self.editor.make_wall(10, 1, 0, 3)
+        self.editor.move_character('A', 0, 1)
+        self.assertEqual((jones.x, jones.y), (1, 2))
+        # Onto the wall, and past it in one jump
+        self.editor.move_character('A', 0, 1)
+        self.editor.move_character('A', 0, 5)
+        self.assertEqual((jones.x, jones.y), (1, 2))
+        # Off the scene
+        self.editor.move_character('A', -5, 0)
+        self.assertEqual((jones.x, jones.y), (1, 2))
+        self.editor.move_character('A', 12, 0)
+        self.assertEqual((jones.x, jones.y), (13, 2))
+        self.editor.move_character('A', 0, 5)
+        self.assertEqual((jones.x, jones.y), (13, 7))
+        self.assertEqual(self.editor.scene.row_string(7)[13], 'J')
+        self.assertEqual(self.editor.scene.row_string(2)[1], ' ')
+
+    def test_duplicate_name(self):
+        jones = Character('Jones', 'A', 54, ('he', 'him', 'his'), (1, 1), (15.0, 20.0, .1, 0.99, 0), (10, 10.0, 6.5))
+        other = Character('Smith', 'A', 30, ('she', 'her', 'her'), (4, 4), (15.0, 20.0, .1, 0.99, 0), (10, 10.0, 6.5))
+        self.editor.add_character(jones)
+        self.editor.add_character(other)
+        self.assertIs(self.editor.characters['A'], jones)
+        self.assertNotIn(other, self.editor.scene.index)
+        self.assertEqual(self.editor.scene.row_string(4)[4], ' ')
+
+class FakeEngine:
+    """ Stands in for the Instance, keeps what the editor sends """
+    def __init__(self):
+        self.sent = []
+        self.parent_queue = queue.Queue()
+
+    def instruction_put(self, instruction):
+        self.sent.append(instruction)
+
+class Stop(Exception):
+    pass
+
+class TestPrompt(unittest.TestCase):
+
+    def test_notices_dont_prompt(self):
+        engine = FakeEngine()
+        editor = SceneEditor(Scene((10, 20), []), engine, screen = 'frames/main')
+        handled = []
+        def handle(instruction):
+            handled.append(instruction.get_task())
+            if instruction.get_task() == 'moveCamera':
+                raise Stop()
+        # Defined by StationKeeper's __main__ block when it runs for real
+        StationKeeper.instruction_handle = handle
+        self.addCleanup(delattr, StationKeeper, 'instruction_handle')
+        engine.parent_queue.put(Instruction('subscribed', ('frames/main', 'display1'), 'game'))
+        engine.parent_queue.put(Instruction('subscribed', ('frames/main', 'display2'), 'game'))
+        engine.parent_queue.put(Instruction('moveCamera', (1, 0), 'game'))
+        with self.assertRaises(Stop):
+            editor.start()
+        self.assertEqual(handled, ['subscribed', 'subscribed', 'moveCamera'])
+        self.assertEqual([instruction.get_task() for instruction in engine.sent], ['getFromPrompt'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+from io import StringIO
+from Terminal import *
+
+class TestTerminal(unittest.TestCase):
+
+    def setUp(self):
+        self.out = StringIO()
+        self.terminal = Terminal(self.out, get_size = lambda: (24, 80))
+
+    def test_skips_repeats(self):
+        self.terminal.clear()
+        self.terminal.clear()
+        self.terminal.set_title('Station Keeper')
+        self.terminal.set_title('Station Keeper')
+        self.terminal.move_to(0, 0)
+        self.terminal.set_size((24, 80))
+        self.assertEqual(self.out.getvalue(), CLEAR + title('Station Keeper'))
+        self.assertEqual(self.terminal.skipped, 4)
+
+    def test_touch(self):
+        self.terminal.clear()
+        self.terminal.touch()
+        self.terminal.clear()
+        self.terminal.move_to(3, 4)
+        self.assertEqual(self.out.getvalue(), CLEAR * 2 + cursor_to(3, 4))
+
+    def test_modes(self):
+        self.terminal.alternate_screen()
+        self.terminal.show_cursor(False)
+        self.terminal.show_cursor(False)
+        self.terminal.alternate_screen(False)
+        self.assertEqual(self.out.getvalue(), ALTERNATE_ON + CURSOR_HIDE + ALTERNATE_OFF)
+
+if __name__ == '__main__':
+    unittest.main()